@@ -0,0 +1,100 @@
+"""
+    Historical cleaning: original per-value loops vs NumPy columns.
+    Both run over the same 20 year daily text response with gaps,
+    and must give byte identical JSON.
+
+    python bench/bench_cleaning.py [years] [fields] [repeat]
+"""
+import datetime as dt
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeBlpapi
+fakeBlpapi.install()
+
+from blbrgPrice import blbrg
+
+
+def legacy_clean(raw, attributes, sparse=False):
+    """
+        clean_raw historical branch before NumPy columns. sparse, as for
+        non-OHLC fields: values that are not numbers are kept as text and
+        rows are only dropped if all their values are missing.
+    """
+    attributes = ['date'] + attributes
+    clean = {key: list() for key in attributes}
+    for grain in raw.split("fieldData = {")[1:]:
+        for idx, atr in enumerate(attributes):
+            datapoint = grain[grain.find(atr) + len(atr + ' ='):][
+                        :grain[grain.find(atr) + len(atr + ' ='):].find('\n')]
+            datapoint = datapoint.strip()
+            if idx:
+                try:
+                    datapoint = float(datapoint)
+                except ValueError:
+                    datapoint = datapoint.strip('"') or None if sparse else None
+            clean[atr].append(datapoint)
+
+    clean = {key: val[::-1] for key, val in clean.items()}
+    none_idx = set()
+    for key in clean.keys():
+        for idx, value in enumerate(clean[key]):
+            if value is None:
+                none_idx.add(idx)
+    if sparse:
+        none_idx = {idx for idx in none_idx if all(clean[key][idx] is None for key in attributes[1:])}
+    for idx in sorted(none_idx, reverse=True):
+        for key in clean.keys():
+            del clean[key][idx]
+    return clean
+
+
+def response(years, fields):
+    """Text dump of a historical response, about 1% of the values missing."""
+    rng = random.Random(0)
+    end = dt.date(2021, 1, 29)
+    start = (end - dt.timedelta(days=365 * years)).strftime('%Y%m%d')
+    messages = fakeBlpapi.BACKEND.historical(['QQQ US Equity'], fields, start, end.strftime('%Y%m%d'),
+                                             fakeBlpapi.CorrelationId())
+    for row in messages[0].getElement('securityData').getElement('fieldData').values():
+        for field in fields:
+            if rng.random() < 0.01:
+                row.setElement(field, 'N/A')
+    return ''.join(map(str, messages)), messages
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main(years=20, n_fields=12, repeat=3):
+    fields = "OPEN HIGH LOW PX_LAST VOLUME".split() + [f'FIELD_{i}' for i in range(n_fields - 5)]
+    raw, messages = response(years, fields)
+
+    b = blbrg(ticker='QQQ US Equity', is_historic=True, attributes=' '.join(fields),
+              path=os.devnull, raw=raw)
+    legacy, legacy_clean_ = timed(lambda: legacy_clean(raw, fields, sparse=not b.is_ohlc), repeat)
+    text, text_clean = timed(b.clean_raw, repeat)
+    assert json.dumps(legacy_clean_) == json.dumps(text_clean)
+
+    b.messages = messages
+    b.parsed = b.parse()
+    parsed, parsed_clean = timed(b.clean_raw, repeat)
+    assert json.dumps(legacy_clean_) == json.dumps(parsed_clean)
+
+    print(f'{len(raw.split("fieldData = {")) - 1} rows x {len(fields)} fields, {len(legacy_clean_["date"])} kept')
+    print(f'legacy loops:        {legacy * 1000:8.2f} ms')
+    print(f'numpy, text path:    {text * 1000:8.2f} ms')
+    print(f'numpy, parsed path:  {parsed * 1000:8.2f} ms')
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
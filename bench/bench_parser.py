@@ -0,0 +1,64 @@
+"""
+    Text scraping vs element tree parsing of large historical responses.
+    Responses are recorded once from the fake blpapi, then both paths
+    clean the same messages.
+
+    python bench/bench_parser.py [years] [repeat]
+"""
+import datetime as dt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeBlpapi
+fakeBlpapi.install()
+
+from blbrgPrice import blbrg
+
+
+def record(years):
+    end = dt.date(2021, 1, 29)
+    start = end - dt.timedelta(days=365 * years)
+    # one request for the whole range, not streamed chunk by chunk, so its messages are kept
+    chunk_days, blbrg.CHUNK_DAYS = blbrg.CHUNK_DAYS, (end - start).days + 1
+    try:
+        return blbrg.from_dict(path=os.devnull, kind='historical', bloomberg_code='QQQ US Equity',
+                               start_date=start.isoformat(), end_date=end.isoformat())
+    finally:
+        blbrg.CHUNK_DAYS = chunk_days
+
+
+def text_path(b):
+    b.raw, b.parsed = None, None
+    b.is_error()
+    return b.clean_raw()
+
+
+def element_path(b):
+    b.raw, b.parsed = None, b.parse()
+    b.is_error()
+    return b.clean_raw()
+
+
+def timed(fn, b, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        clean = fn(b)
+    return (time.perf_counter() - start) / repeat, clean
+
+
+def main(years=10, repeat=5):
+    b = record(years)
+    rows = len(b.parse().rows)
+    text, text_clean = timed(text_path, b, repeat)
+    element, element_clean = timed(element_path, b, repeat)
+    assert text_clean == element_clean
+    print(f'{rows} rows x {len(b.attributes)} fields')
+    print(f'text    (str + regex): {text * 1000:8.2f} ms')
+    print(f'element (tree walk):   {element * 1000:8.2f} ms  x{text / element:.1f}')
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""
+    Per-request sessions vs pooled sessions against the fake blpapi.
+
+    python bench/bench_session_pool.py [requests] [threads] [session_latency]
+"""
+import os
+import sys
+import tempfile
+import time
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeBlpapi
+fakeBlpapi.install()
+
+from blbrgPrice import blbrg
+from pRequests import BloombergAdapter
+from sessionPool import SessionPool
+
+
+def run(adapter, n_requests, threads, out_dir):
+    requests = [{'kind': 'real-time', 'bloomberg_code': f'T{i} US Equity', 'attributes': 'PX_LAST',
+                 'path': os.path.join(out_dir, f'{i}.json')} for i in range(n_requests)]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        for f in concurrent.futures.as_completed([executor.submit(adapter.create_dump, r) for r in requests]):
+            f.result()
+    return time.perf_counter() - start
+
+
+def main(n_requests=200, threads=8, session_latency=0.05):
+    fakeBlpapi.BACKEND.session_latency = session_latency
+    with tempfile.TemporaryDirectory() as out_dir:
+        elapsed = run(BloombergAdapter(blbrg), n_requests, threads, out_dir)
+        print(f'per-request sessions: {elapsed:.3f}s  {n_requests / elapsed:.1f} req/s')
+
+        pool = SessionPool(size=threads)
+        start = time.perf_counter()
+        pool.warm_up()
+        print(f'pool warm-up:         {time.perf_counter() - start:.3f}s')
+        elapsed = run(BloombergAdapter(blbrg, pool), n_requests, threads, out_dir)
+        print(f'pooled sessions:      {elapsed:.3f}s  {n_requests / elapsed:.1f} req/s')
+        pool.close()
+
+
+if __name__ == "__main__":
+    main(*[float(a) if '.' in a else int(a) for a in sys.argv[1:]])
@@ -0,0 +1,148 @@
+"""
+    Cold start against the fake blpapi: seconds from launching the server
+    to the response of a request waiting in the spool, with the deferred
+    imports and background pool warm-up, and as before (numpy, pandas and
+    blpapi imported up front, pool warmed up before serving).
+    Then the restart of a server holding pending requests and cached
+    responses, with and without its snapshot.
+
+    python bench/bench_startup.py [runs] [session_latency]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TIMEOUT_SECS = 60
+REQUEST = {'kind': 'real-time', 'bloomberg_code': 'AAPL US Equity', 'attributes': 'PX_LAST'}
+STATIC = {'kind': 'real-time', 'bloomberg_code': 'AAPL US Equity', 'attributes': 'NAME CRNCY'}
+
+
+def child(mode, session_latency, request_latency):
+    """Runs the server in the current directory, as the old start up if mode is 'eager'."""
+    import_start = time.perf_counter()
+    if mode == 'eager':
+        import numpy
+        import pandas.tseries.offsets
+    import fakeBlpapi
+    fakeBlpapi.install()
+    fakeBlpapi.BACKEND.session_latency = session_latency
+    fakeBlpapi.BACKEND.request_latency = request_latency
+    import run
+    print(json.dumps({'import': time.perf_counter() - import_start}), flush=True)
+    if mode == 'eager':
+        def warmed_pool(**kwargs):
+            pool = SessionPool(**kwargs)
+            pool.warm_up()
+            return pool
+        SessionPool = run.SessionPool
+        run.SessionPool = warmed_pool
+        run.warm_up = lambda pool: None
+    run.serve()
+
+
+def launch(directory, mode, session_latency, request_latency=0.0):
+    for folder in ('requests', 'responses', 'requests_debug', 'datasets'):
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', mode,
+                             str(session_latency), str(request_latency)],
+                            cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def put(directory, name, request):
+    with open(os.path.join(directory, 'requests', name + '.tmp'), 'w') as outf:
+        json.dump(request, outf)
+    os.replace(os.path.join(directory, 'requests', name + '.tmp'), os.path.join(directory, 'requests', name))
+
+
+def wait_for(directory, names):
+    deadline = time.time() + TIMEOUT_SECS
+    while time.time() < deadline:
+        if all(os.path.exists(os.path.join(directory, 'responses', name)) for name in names):
+            return True
+        time.sleep(0.002)
+    return False
+
+
+def stop(process):
+    process.terminate()
+    process.wait(TIMEOUT_SECS)
+
+
+def cold_start(mode, session_latency):
+    """(seconds to import, seconds from launch to the first response)"""
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'requests'))
+        put(directory, 'first.json', REQUEST)
+        start = time.perf_counter()
+        process = launch(directory, mode, session_latency)
+        try:
+            if not wait_for(directory, ['first.json']):
+                raise TimeoutError(f'{mode}: no response')
+            elapsed = time.perf_counter() - start
+            imported = json.loads(process.stdout.readline())['import']
+        finally:
+            stop(process)
+    return imported, elapsed
+
+
+def restart(session_latency, n_requests=50, request_latency=0.2, snapshot=True):
+    """
+        (seconds until a restarted server answers a static request cached
+        before the restart, pending requests answered before the restart,
+        answered in all)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        process = launch(directory, 'lazy', session_latency, request_latency)
+        put(directory, 'static.json', STATIC)
+        wait_for(directory, ['static.json'])
+        # requests still held in memory: the server is stopped as soon as it has claimed them
+        names = [f'pending_{i}.json' for i in range(n_requests)]
+        for i, name in enumerate(names):
+            put(directory, name, {**REQUEST, 'bloomberg_code': f'T{i} US Equity'})
+        while os.listdir(os.path.join(directory, 'requests')):
+            time.sleep(0.001)
+        stop(process)
+        answered_before = sum(os.path.exists(os.path.join(directory, 'responses', name)) for name in names)
+        if not snapshot:
+            os.remove(os.path.join(directory, 'state.json'))
+
+        put(directory, 'static_again.json', STATIC)
+        start = time.perf_counter()
+        process = launch(directory, 'lazy', session_latency, request_latency)
+        try:
+            wait_for(directory, ['static_again.json'])
+            elapsed = time.perf_counter() - start
+            if snapshot:
+                wait_for(directory, names)
+            else:
+                time.sleep(n_requests * request_latency)
+        finally:
+            stop(process)
+        answered = sum(os.path.exists(os.path.join(directory, 'responses', name)) for name in names)
+    return elapsed, answered_before, answered
+
+
+def main(runs=5, session_latency=0.05):
+    for mode in ('eager', 'lazy'):
+        results = [cold_start(mode, session_latency) for _ in range(runs)]
+        imported = sorted(r[0] for r in results)[runs // 2]
+        first = sorted(r[1] for r in results)[runs // 2]
+        print(f'{mode:6s} import {imported * 1000:7.1f}ms  first response {first * 1000:7.1f}ms  (median of {runs})')
+
+    for snapshot in (False, True):
+        elapsed, before, after = restart(session_latency, snapshot=snapshot)
+        print(f'restart {"with" if snapshot else "without"} snapshot: static request answered in '
+              f'{elapsed * 1000:.1f}ms, pending requests answered {before}/50 before the restart, {after}/50 after')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], float(sys.argv[3]), float(sys.argv[4]))
+    else:
+        main(*[cast(arg) for cast, arg in zip((int, float), sys.argv[1:])])
@@ -0,0 +1,128 @@
+"""
+    End-to-end throughput of the request engines against the fake blpapi.
+
+    For every engine a fresh requests/responses tree is fed by the load
+    generator (market open bursts, backfills, malformed files) while the
+    factory runs on it. Latency is the time from a request file being
+    written to its response file being written (its mtime).
+
+    python bench/bench_throughput.py [engine ...]
+
+    Engines are the RequestFactory.handle_many_* methods listed in ENGINES;
+    a new engine only needs an entry there.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeBlpapi
+fakeBlpapi.install()
+
+from blbrgPrice import blbrg
+from pRequests import BloombergAdapter, RequestFactory, DuplicatedEntryError, frequencyUpdater
+from scheduler import Scheduler
+from eventEngine import EventEngine
+from sessionPool import SessionPool
+from metrics import METRICS
+from loadgen import LoadGenerator, PRODUCTION
+
+# engine name: (factory method, runs on a Scheduler, requests multiplexed on an EventEngine)
+ENGINES = {'sync': (RequestFactory.handle_many_sync, False, False),
+           'async': (RequestFactory.handle_many_async, False, False),
+           'pipelined': (RequestFactory.handle_many_pipelined, True, False),
+           'evented': (RequestFactory.handle_many_pipelined, True, True)}
+
+POOL_SIZE = 8
+SCAN_SECS = 0.01
+TIMEOUT_SECS = 300
+
+BACKEND = dict(session_latency=0.05, request_latency=0.02, latency_sigma=0.5,
+               row_latency=2e-6, error_rate=0.01)
+
+
+def run(engine, root, scenario=PRODUCTION):
+    """Plays the scenario against one engine, returns LoadGenerator.sent and the responses directory."""
+    handle, scheduled, evented = ENGINES[engine]
+    directories = [os.path.join(root, name) for name in ('requests', 'responses', 'requests_debug')]
+    for directory in directories:
+        os.mkdir(directory)
+    requests, responses, _ = directories
+
+    if evented:
+        pool, events = None, EventEngine()
+        adapter = BloombergAdapter(blbrg, engine=events)
+    else:
+        pool, events = SessionPool(size=POOL_SIZE), None
+        pool.warm_up()
+        adapter = BloombergAdapter(blbrg, pool)
+    scheduler = Scheduler(max_workers=POOL_SIZE) if scheduled else None
+    factory = RequestFactory(*directories, frequencyUpdater(), adapter, scheduler=scheduler)
+
+    generator = LoadGenerator(requests)
+    feeding = generator.start(scenario)
+    deadline = time.monotonic() + TIMEOUT_SECS
+    try:
+        while time.monotonic() < deadline:
+            try:
+                factory.process()
+            except DuplicatedEntryError:
+                pass
+            handle(factory)
+            if not feeding.is_alive() and len(os.listdir(responses)) >= len(generator.sent):
+                break
+            time.sleep(SCAN_SECS)
+    finally:
+        if scheduler is not None:
+            scheduler.shutdown()
+        if pool is not None:
+            pool.close()
+        if events is not None:
+            events.close()
+    return generator.sent, responses
+
+
+def report(engine, sent, responses):
+    latencies = dict()
+    errors = 0
+    done = list()
+    for name, (kind, written) in sent.items():
+        path = os.path.join(responses, name)
+        if not os.path.exists(path):
+            continue
+        finished = os.stat(path).st_mtime
+        done.append(finished)
+        latencies.setdefault(kind, list()).append(finished - written)
+        with open(path) as inf:
+            response = json.load(inf)
+        # security errors come back as a message in place of the data
+        errors += 'error' in response or isinstance(response.get('data'), str)
+
+    first = min(written for _, written in sent.values())
+    elapsed = max(done) - first if done else float('nan')
+    print(f'{engine:<10} {len(done)}/{len(sent)} responses in {elapsed:.2f}s  '
+          f'{len(done) / elapsed:.1f} req/s  {errors} errors')
+    for kind, values in sorted(latencies.items()):
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        print(f'    {kind:<12} n={len(values):<5} p50 {p50:8.1f} ms   p99 {p99:8.1f} ms')
+    for stage, (count, total) in sorted(METRICS.stages().items(), key=lambda item: -item[1][1]):
+        print(f'    stage {stage:<12} n={count:<5} total {total:8.2f} s   mean {total / count * 1000:8.2f} ms')
+
+
+def main(*engines):
+    for key, value in BACKEND.items():
+        setattr(fakeBlpapi.BACKEND, key, value)
+    for engine in engines or ENGINES:
+        METRICS.reset()
+        with tempfile.TemporaryDirectory() as root:
+            sent, responses = run(engine, root)
+            report(engine, sent, responses)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,100 @@
+"""
+    Load generator writing request files the way clients do in production.
+
+    A scenario is a list of (seconds from start, burst, count) events:
+        market_open -- real-time requests for many tickers within a few ms,
+                       on a handful of field sets
+        backfill -- historical requests over long ranges
+        malformed -- files that are not valid JSON
+        trickle -- real-time requests spread over a second
+
+    Well formed requests are written next to the requests directory and
+    moved in, as clients are expected to do; malformed ones are written
+    in place. LoadGenerator.sent keeps {file name: (kind, time written)}.
+"""
+import datetime as dt
+import json
+import os
+import random
+import threading
+import time
+
+FIELD_SETS = ["PX_LAST", "PX_LAST PX_BID PX_ASK", "PX_LAST VOLUME", "OPEN HIGH LOW PX_LAST VOLUME"]
+OHLC = "OPEN HIGH LOW PX_LAST VOLUME"
+
+PRODUCTION = [(0.0, 'market_open', 300),
+              (0.2, 'backfill', 10),
+              (0.5, 'malformed', 5),
+              (1.0, 'trickle', 50),
+              (2.0, 'market_open', 200),
+              (2.5, 'backfill', 10)]
+
+
+class LoadGenerator:
+    def __init__(self, directory, tickers=500, seed=0, end_date=dt.date(2021, 1, 29)):
+        self.directory = str(directory)
+        self.staging = self.directory.rstrip(os.sep) + '_staging'
+        os.makedirs(self.staging, exist_ok=True)
+        self.tickers = [f'T{i:04d} US Equity' for i in range(tickers)]
+        self.end_date = end_date
+        self.sent = dict()
+        self._random = random.Random(seed)
+        self._count = 0
+
+    def _name(self, kind):
+        self._count += 1
+        return f'{kind}_{self._count:06d}.json'
+
+    def write(self, kind, content):
+        """Moves one request file in, content is a dict or raw text."""
+        name = self._name(kind)
+        if isinstance(content, dict):
+            staged = os.path.join(self.staging, name)
+            with open(staged, 'w') as outf:
+                json.dump(content, outf)
+            self.sent[name] = (kind, time.time())
+            os.replace(staged, os.path.join(self.directory, name))
+        else:
+            self.sent[name] = (kind, time.time())
+            with open(os.path.join(self.directory, name), 'w') as outf:
+                outf.write(content)
+        return name
+
+    def real_time(self):
+        return {"kind": "real-time", "bloomberg_code": self._random.choice(self.tickers),
+                "attributes": self._random.choice(FIELD_SETS)}
+
+    def historical(self, years):
+        start = self.end_date - dt.timedelta(days=int(365 * years))
+        return {"kind": "historical", "bloomberg_code": self._random.choice(self.tickers),
+                "attributes": OHLC, "start_date": start.isoformat(), "end_date": self.end_date.isoformat()}
+
+    def market_open(self, count):
+        for _ in range(count):
+            self.write('real-time', self.real_time())
+
+    def backfill(self, count):
+        for _ in range(count):
+            self.write('historical', self.historical(self._random.choice((1, 5, 20))))
+
+    def malformed(self, count):
+        for _ in range(count):
+            text = json.dumps(self.real_time())
+            self.write('malformed', text[:self._random.randrange(1, len(text) - 1)])
+
+    def trickle(self, count):
+        for _ in range(count):
+            self.write('real-time', self.real_time())
+            time.sleep(1 / count)
+
+    def run(self, scenario=PRODUCTION):
+        """Plays the scenario, blocking until its last burst is written."""
+        start = time.monotonic()
+        for at, burst, count in sorted(scenario):
+            time.sleep(max(0.0, start + at - time.monotonic()))
+            getattr(self, burst)(count)
+
+    def start(self, scenario=PRODUCTION):
+        thread = threading.Thread(target=self.run, args=(scenario,), name='loadgen', daemon=True)
+        thread.start()
+        return thread
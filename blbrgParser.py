@@ -0,0 +1,75 @@
+"""Structured parsing of blpapi responses by walking the element tree"""
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SecurityData:
+    """
+        Parsed securityData element of one security.
+        fields -- {field: value} of a ReferenceDataResponse
+        rows -- [{'date': date, field: value}] of a HistoricalDataResponse
+    """
+    security: str
+    error: str = None
+    field_exceptions: dict = field(default_factory=dict)
+    fields: dict = field(default_factory=dict)
+    rows: list = field(default_factory=list)
+
+
+def value_of(element):
+    """Typed python value of an element: scalar, list or dict."""
+    if element.isArray():
+        return [value_of(v) if hasattr(v, 'elements') else v for v in element.values()]
+    if element.isComplexType():
+        return {str(e.name()): value_of(e) for e in element.elements()}
+    return element.getValue()
+
+
+def parse_security(element):
+    parsed = SecurityData(security=element.getElementAsString('security'))
+
+    if element.hasElement('securityError'):
+        parsed.error = element.getElement('securityError').getElementAsString('message')
+
+    if element.hasElement('fieldExceptions'):
+        for exception in element.getElement('fieldExceptions').values():
+            parsed.field_exceptions[exception.getElementAsString('fieldId')] = \
+                exception.getElement('errorInfo').getElementAsString('message')
+
+    if element.hasElement('fieldData'):
+        field_data = element.getElement('fieldData')
+        if field_data.isArray():
+            parsed.rows = [{str(f.name()): value_of(f) for f in row.elements()} for row in field_data.values()]
+        else:
+            parsed.fields = {str(f.name()): value_of(f) for f in field_data.elements()}
+    return parsed
+
+
+def parse_messages(messages):
+    """
+        Walks the securityData of ReferenceDataResponse and
+        HistoricalDataResponse messages, skipping status messages.
+        Rows of a security split over partial responses are joined.
+
+        Returns (response error message or None, {security: SecurityData})
+    """
+    response_error = None
+    securities = dict()
+    for msg in messages:
+        if msg.hasElement('responseError'):
+            response_error = msg.getElement('responseError').getElementAsString('message')
+        if not msg.hasElement('securityData'):
+            continue
+
+        security_data = msg.getElement('securityData')
+        for element in (security_data.values() if security_data.isArray() else [security_data]):
+            parsed = parse_security(element)
+            if parsed.security in securities:
+                known = securities[parsed.security]
+                known.rows += parsed.rows
+                known.fields.update(parsed.fields)
+                known.field_exceptions.update(parsed.field_exceptions)
+                known.error = known.error or parsed.error
+            else:
+                securities[parsed.security] = parsed
+    return response_error, securities
@@ -1,22 +1,75 @@
+import concurrent.futures
 import datetime as dt
 import sys
 import os
-from pandas.tseries.offsets import BDay
-import numpy as np
 import json
-import blpapi
 import re
+import threading
+from blbrgParser import SecurityData, parse_messages
+from respWriter import JsonColumnWriter, WRITERS, FORMATS, newest_date, prepend_rows
+from metrics import METRICS
+from eventEngine import EventEngine, SessionLostError
+from lazyImport import lazy_import
+
+np = lazy_import('numpy')
+blpapi = lazy_import('blpapi')
 
 
 class blbrg():
     """
     bloomberg data provider
+
+    Responses are parsed by walking the blpapi element tree (PARSER = "element").
+    PARSER = "text" keeps the original str(msg) + regex scraping, which is also
+    the fallback when no structured response is available.
+
+    If a HistoricalCache is set as blbrg.cache, historical requests are served
+    from it and only the missing date ranges are fetched from the terminal.
+    If a TokenBucket is set as blbrg.limiter, every request sent to the
+    terminal takes a token from it first.
+
+    The session may be an EventEngine: requests are then sent on its
+    shared event-handler session and awaited as futures (see get_chunks_async).
+
+    Historical ranges longer than CHUNK_DAYS are split into chunks sent
+    together, and fetched and written while dumping, at most
+    PARALLEL_CHUNKS chunks at a time (see stream_dump).
+
+    Historical requests of several fields, OHLC or not, are one
+    HistoricalDataRequest aligned by date. Rows missing an OHLC field are
+    dropped; other fields (split factors, estimates) are not reported
+    every day, their rows are kept with None where a field has no value.
+
+    A historical request with append_to (a JSON response path) only
+    fetches the bars from the newest date stored there and adds them in
+    front of it (see append_dump). The first request builds it whole.
+    "dataset" requests append to <name>.json in blbrg.datasets.
     """
+    SESSION_DOWN = ("SessionConnectionDown", "SessionTerminated")
+    PARSER = "element"
+    CHUNK_DAYS = 2 * 365
+    PARALLEL_CHUNKS = 4
+    cache = None
+    limiter = None
+    datasets = None
+    _append_locks = dict()
+
     def __init__(self, ticker, is_historic=False, start_date=None, end_date=None,
-                 attributes="OPEN HIGH LOW PX_LAST VOLUME", path="dump.json", error=False):
+                 attributes="OPEN HIGH LOW PX_LAST VOLUME", path="dump.json", error=False, session=None,
+                 raw=None, parsed=None, response_format="json", append_to=None):
         self.ticker = ticker
+        self.response_format = response_format
+        self.securities = [ticker]
         self.error = error
         self.path = path
+        self.session = session
+        self.session_lost = False
+        self.messages = None
+        self.parsed = parsed
+        self._raw = raw
+        self.streamed = False
+        self.append_to = append_to
+        self.newest = None
 
         if self.error:
             self.clean = "JSON format error."
@@ -28,17 +81,126 @@ class blbrg():
             self.end_date = end_date
             self.is_historic = is_historic
 
-            # Get raw data from API
-            self.getRaw()
+            # Appending: only the bars from the newest one stored, which may not have been final
+            if append_to is not None:
+                try:
+                    self.newest = newest_date(append_to, ['date'] + self.attributes)
+                except ValueError as e:
+                    parsed = self.parsed = SecurityData(security=ticker, error=str(e))
+                if self.newest is not None:
+                    self.start_date = max(start_date, self.newest.replace('-', ''))
+                    if self.start_date > end_date and raw is None and parsed is None:
+                        parsed = self.parsed = SecurityData(security=ticker)
+
+            # Long ranges are fetched by get_dump chunk by chunk; new rows
+            # are added in front of stored ones whole (see append_dump)
+            self.streamed = self.is_historic and blbrg.PARSER == "element" and response_format == "json" \
+                and raw is None and parsed is None and self.newest is None \
+                and len(self.chunks(self.start_date, end_date)) > 1
+            if self.streamed:
+                return
+
+            # Get raw data from API unless already fetched by a batch
+            if raw is None and parsed is None:
+                if self.is_historic and blbrg.cache is not None and blbrg.PARSER == "element":
+                    self.parsed = blbrg.cache.load(self)
+                else:
+                    self.getRaw()
+                    if self.messages and blbrg.PARSER == "element":
+                        self.parsed = self.parse()
             # Check for errors in raw
             if not self.is_error():
-                if self.is_ohlc:
-                    self.clean = self.clean_raw()
+                with METRICS.stage('clean'):
+                    if self.is_ohlc or self.is_historic:
+                        self.clean = self.clean_raw()
 
-                elif not self.is_ohlc:
-                    self.clean = self.clean_raw_not_ohlc()
+                    elif not self.is_ohlc:
+                        self.clean = self.clean_raw_not_ohlc()
+
+                if not self.is_historic and blbrg.cache is not None and self.parsed is not None \
+                        and 'EQY_SPLIT_DT' in self.parsed.fields:
+                    blbrg.cache.invalidate_split(self.ticker, self.parsed.fields['EQY_SPLIT_DT'])
+
+    @property
+    def raw(self):
+        """Text dump of the response, built on first use only."""
+        if self._raw is None:
+            self._raw = "".join(str(msg) for msg in self.messages or ())
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        self._raw = raw
+
+    def parse(self):
+        """SecurityData of this ticker, None if the response has no securityData."""
+        with METRICS.stage('parse'):
+            response_error, securities = parse_messages(self.messages)
+        if response_error is not None:
+            return SecurityData(security=self.ticker, error=response_error)
+        return securities.get(self.ticker, next(iter(securities.values()), None))
+
+    @staticmethod
+    def as_text(value):
+        """Value rendered as in the text dump of blpapi."""
+        if isinstance(value, str):
+            return f'"{value}"'
+        if isinstance(value, (dt.date, dt.datetime)):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def as_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def float_column(cls, values):
+        """float64 column with NaN where a value is missing or not a number."""
+        try:
+            return np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            return np.array([np.nan if v is None else v for v in map(cls.as_float, values)], dtype=np.float64)
+
+    @classmethod
+    def value_column(cls, values):
+        """
+        Column of a field not reported every day: numbers as floats, other
+        values as text and None where there is no value.
+        """
+        column = cls.float_column(values)
+        missing = np.isnan(column)
+        if not missing.any():
+            return column.tolist()
+        return [None if value is None or value == '' else (value.isoformat() if isinstance(value, (dt.date, dt.datetime))
+                                                           else str(value).strip('"'))
+                if nan else number for value, number, nan in zip(values, column.tolist(), missing)]
+
+    @classmethod
+    def clean_columns(cls, dates, columns, sparse=False):
+        """
+        Historical output from the dates and {field: values} in response order.
+        Columns are reversed and every row with a missing value is dropped
+        with one NaN mask over all fields.
+        sparse -- fields not reported every day (anything but OHLC): rows
+        with any value are kept instead, missing values as None.
+        """
+        dates = np.array(dates, dtype=object)[::-1]
+        if sparse:
+            values = {atr: cls.value_column(column[::-1]) for atr, column in columns.items()}
+            keep = [any(values[atr][i] is not None for atr in values) for i in range(len(dates))]
+            return {'date': dates[keep].tolist() if values else dates.tolist(),
+                    **{atr: [v for v, k in zip(column, keep) if k] for atr, column in values.items()}}
+        values = {atr: cls.float_column(column)[::-1] for atr, column in columns.items()}
+        keep = ~np.logical_or.reduce([np.isnan(column) for column in values.values()]) \
+            if values else np.ones(len(dates), dtype=bool)
+        return {'date': dates[keep].tolist(), **{atr: column[keep].tolist() for atr, column in values.items()}}
 
     def clean_raw_not_ohlc(self):
+        if self.parsed is not None:
+            return self.clean_parsed_not_ohlc()
         clean = {}
         for attrs in self.attributes:
             extracted = re.search(f'({attrs} = )(.*)(\n)', self.raw)
@@ -46,110 +208,211 @@ class blbrg():
                 clean[attrs] = extracted.group(2)
         return clean
 
+    def clean_parsed_not_ohlc(self):
+        clean = {}
+        for attrs in self.attributes:
+            for fields in [self.parsed.fields] + self.parsed.rows:
+                if attrs in fields:
+                    clean[attrs] = self.as_text(fields[attrs])
+                    break
+        return clean
+
     def is_error(self):
-        self.error = re.search('(message = ")(.*?")', self.raw)
+        if self.parsed is not None:
+            self.error = self.parsed.error or next(iter(self.parsed.field_exceptions.values()), None)
+        else:
+            self.error = re.search('(message = ")(.*?")', self.raw)
+            if self.error:
+                self.error = self.error.group(2)
         if self.error:
-            self.error = self.error.group(2)
             self.clean = self.error
+            METRICS.count('errors', type='bloomberg')
             return True
         return False
 
+    def fetch_ranges(self, ranges):
+        """
+        Parsed historical responses of YYYYMMDD (start, end) ranges, one
+        per range, all fetched together. None for every range if the
+        fetch failed, the reason is then in raw.
+        """
+        pieces = [(idx, chunk) for idx, (start_date, end_date) in enumerate(ranges)
+                  for chunk in self.chunks(start_date, end_date)]
+        with METRICS.stage('fetch'):
+            chunks = self.get_chunks(self.attributes, [chunk for _, chunk in pieces])
+        if not chunks:
+            return [None] * len(ranges)
+        messages = [list() for _ in ranges]
+        for (idx, _), chunk in zip(pieces, chunks):
+            messages[idx] += chunk
+        return [self.parse_chunk(range_messages) for range_messages in messages]
+
     def getRaw(self):
         if not self.is_historic and self.is_ohlc:
-            self.raw = self.get(self.attributes + ['CRNCY'])
+            self.messages = self.get(self.attributes + ['CRNCY'])
         else:
-            # Ohlc historic or not ohlc data and only one field can be pulled at a time
-            self.raw = self.get(self.attributes)
+            # Historical requests of any fields are one HistoricalDataRequest, aligned by date in clean_raw
+            self.messages = self.get(self.attributes)
 
 
-    def get(self, attribs):
-        """Get price from bloomberg terminal real-time or historic"""
+    def chunks(self, start_date, end_date):
+        """
+        YYYYMMDD range split into consecutive ranges of at most CHUNK_DAYS days.
+        Dates that do not parse are left to the terminal to reject.
+        """
+        try:
+            start = dt.datetime.strptime(start_date, '%Y%m%d').date()
+            end = dt.datetime.strptime(end_date, '%Y%m%d').date()
+        except (TypeError, ValueError):
+            return [(start_date, end_date)]
+        ranges = []
+        while start <= end:
+            chunk_end = min(end, start + dt.timedelta(days=blbrg.CHUNK_DAYS - 1))
+            ranges.append((start.strftime('%Y%m%d'), chunk_end.strftime('%Y%m%d')))
+            start = chunk_end + dt.timedelta(days=1)
+        return ranges or [(start_date, end_date)]
+
+    def get(self, attribs, start_date=None, end_date=None):
+        """
+        Get price from bloomberg terminal real-time or historic.
+        Long historical ranges are fetched as concurrent chunks and
+        reassembled in date order.
+        """
+        start_date, end_date = start_date or self.start_date, end_date or self.end_date
+        ranges = self.chunks(start_date, end_date) if self.is_historic else [(None, None)]
+        with METRICS.stage('fetch'):
+            chunks = self.get_chunks(attribs, ranges)
+        return [msg for messages in chunks for msg in messages]
+
+    def create_request(self, service, attribs, start_date, end_date):
+        if self.is_historic:
+            request = service.createRequest("HistoricalDataRequest")
+        else:
+            request = service.createRequest("ReferenceDataRequest")
+
+        for security in self.securities:
+            request.getElement("securities").appendValue(security)
+
+        for atr in attribs:
+            request.getElement("fields").appendValue(atr)
+
+        if self.is_historic:
+            request.set("periodicityAdjustment", "ACTUAL")
+            request.set("periodicitySelection", "DAILY")
+            request.set("startDate", start_date)
+            request.set("endDate", end_date)
+
+        if blbrg.limiter is not None:
+            with METRICS.stage('rate_limit'):
+                blbrg.limiter.acquire()
+        return request
+
+    def get_chunks_async(self, attribs, ranges):
+        """
+        get_chunks on an EventEngine: every range is sent at once on the
+        engine's shared session and the futures are awaited together.
+        """
+        engine = self.session
+        try:
+            futures = [engine.send(self.create_request(engine, attribs, start_date, end_date))
+                       for start_date, end_date in ranges]
+            return [future.result(EventEngine.REQUEST_TIMEOUT_SECS) for future in futures]
+        except SessionLostError as e:
+            self.session_lost = True
+            self.raw = e.message
+        except concurrent.futures.TimeoutError:
+            for future in futures:
+                engine.cancel(future)
+            self.raw = "Request timed out."
+        return []
+
+    def get_chunks(self, attribs, ranges):
+        """
+        Sends one request per (start, end) range at once and collects the
+        messages of each by correlation id. Returns a list of messages
+        per range, status messages go with the first one.
+        Uses the borrowed pooled session if any, otherwise a session is
+        started and stopped for these requests.
+        """
+        if isinstance(self.session, EventEngine):
+            return self.get_chunks_async(attribs, ranges)
         try:
-            sessionOptions = blpapi.SessionOptions()
-            sessionOptions.setServerHost('localhost')
-            sessionOptions.setServerPort(8194)
-            session = blpapi.Session(sessionOptions)
+            session = self.session
+            if session is None:
+                sessionOptions = blpapi.SessionOptions()
+                sessionOptions.setServerHost('localhost')
+                sessionOptions.setServerPort(8194)
+                session = blpapi.Session(sessionOptions)
 
-            if not session.start():
-                print("Failed to start session.")
+                if not session.start():
+                    print("Failed to start session.")
 
-            if not session.openService("//blp/refdata"):
-                print("Failed to open //blp/refdata")
+                if not session.openService("//blp/refdata"):
+                    print("Failed to open //blp/refdata")
 
             refDataService = session.getService("//blp/refdata")
 
-            if self.is_historic:
-                request = refDataService.createRequest("HistoricalDataRequest")
-            else:
-                request = refDataService.createRequest("ReferenceDataRequest")
-
-            request.getElement("securities").appendValue(self.ticker)
+            cids = []
+            for start_date, end_date in ranges:
+                request = self.create_request(refDataService, attribs, start_date, end_date)
+                cids.append(session.sendRequest(request))
 
-            for atr in attribs:
-                request.getElement("fields").appendValue(atr)
-
-            if self.is_historic:
-                request.set("periodicityAdjustment", "ACTUAL")
-                request.set("periodicitySelection", "DAILY")
-                request.set("startDate", self.start_date)
-                request.set("endDate", self.end_date)
-
-            session.sendRequest(request)
-
-            result_string = ""
+            status = []
+            messages = {cid: [] for cid in cids}
+            pending = set(cids)
             try:
-                while (True):
+                while pending:
                     ev = session.nextEvent(500)
                     for msg in ev:
-                        result_string += str(msg)
-                    if ev.eventType() == blpapi.Event.RESPONSE:
-                        break
+                        if ev.eventType() == blpapi.Event.SESSION_STATUS and \
+                                str(msg.messageType()) in blbrg.SESSION_DOWN and self.session is not None:
+                            self.session_lost = True
+                            self.raw = "Failed to start session."
+                            return []
+                        cid = next((c for c in msg.correlationIds() if c in messages), None)
+                        if cid is None:
+                            # late responses of earlier requests on a pooled session are dropped
+                            if ev.eventType() not in (blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE):
+                                status.append(msg)
+                            continue
+                        messages[cid].append(msg)
+                        if ev.eventType() == blpapi.Event.RESPONSE:
+                            pending.discard(cid)
             finally:
-                session.stop()
-            return result_string
+                if self.session is None:
+                    session.stop()
+            return [status + messages[cids[0]]] + [messages[cid] for cid in cids[1:]]
         except blpapi.InvalidArgumentException:
-            return "Failed to start session."
+            self.raw = "Failed to start session."
+            return []
+        except blpapi.InvalidStateException:
+            self.session_lost = True
+            self.raw = "Failed to start session."
+            return []
 
     def clean_raw(self):
+        if self.parsed is not None:
+            return self.clean_parsed()
         attributes = self.attributes.copy()
         try:
             if self.is_historic:
-                attributes.insert(0, 'date')
-                clean = {key: list() for key in attributes}
+                columns = {key: list() for key in ['date'] + attributes}
+                labels = [(columns[key].append, f' {key} = ') for key in columns]
 
                 for grain in self.raw.split("fieldData = {")[1:]:
-                    for idx, atr in enumerate(attributes):
-                        datapoint = grain[grain.find(atr) + len(atr + ' ='):][
-                                    :grain[grain.find(atr) + len(atr + ' ='):].find('\n')]
-                        datapoint = datapoint.strip()
-                        if idx: # TO FLOAT
-                            try:
-                                datapoint = float(datapoint) # .strip()
-                            except ValueError:
-                                datapoint = None
-                            except TypeError:
-                                pass        
-                        clean[atr].append(datapoint)
-
-                clean = {key: val[::-1] for key, val in clean.items()}
-
-                # REMOVE LINES WITH NONE IN THEM
-                none_idx = set()
-                for key in clean.keys():
-
-                    # IF A WHOLE COLUMN IS NONE THEN DO NOTHING
-                    # if all(v is None for v in clean[key]):
-                    #     none_idx = set()
-                    #     break
-
-                    for idx, value in enumerate(clean[key]):
-                        if isinstance(value, type(None)):
-                            none_idx.add(idx)
-
-                for idx in sorted(none_idx, reverse=True):
-                    for key in clean.keys():
-                        del clean[key][idx]
-                # REMOVE LINES WITH NONE IN THEM
+                    # the first " name = " line of a row wins, str.find is
+                    # faster than a regex over every line of the dump;
+                    # a field not reported that day has no line in the row
+                    for append, label in labels:
+                        start = grain.find(label)
+                        if start < 0:
+                            append(None)
+                            continue
+                        start += len(label)
+                        end = grain.find('\n', start)
+                        append(grain[start:end if end >= 0 else None].rstrip())
+
+                clean = self.clean_columns(columns.pop('date'), columns, sparse=not self.is_ohlc)
 
             else:
                 clear = self.raw.replace("\n", "")
@@ -171,18 +434,140 @@ class blbrg():
             self.error = True
             return {"error": self.raw}
 
+    def clean_parsed(self):
+        """clean_raw output built from the parsed response."""
+        if self.is_historic:
+            rows = self.parsed.rows
+            return self.clean_columns([self.as_text(row.get('date')) for row in rows],
+                                      {atr: [row.get(atr) for row in rows] for atr in self.attributes},
+                                      sparse=not self.is_ohlc)
+
+        fields = self.parsed.fields
+        if 'CRNCY' not in fields:
+            self.error = True
+            return {"error": self.raw}
+        clean = {'CRNCY': fields['CRNCY']}
+        for key in self.attributes:
+            value = self.as_float(fields.get(key))
+            if value is not None:
+                clean[key] = value
+        return clean
+
     def get_json(self):
         return {"security": self.ticker,
                     "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
                     "data": self.clean}
 
     def get_dump(self):
-        with open(self.path, "w") as outf:
+        """
+        Writes the response in the requested format.
+        Error responses are always written as JSON.
+        """
+        if self.append_to is not None and not self.error:
+            return self.append_dump()
+        if self.streamed:
+            return self.stream_dump()
+        if self.response_format in WRITERS and not self.error and isinstance(self.clean, dict):
+            try:
+                response = self.get_json()
+                with METRICS.stage('write'):
+                    return WRITERS[self.response_format](self.path, {"security": response["security"],
+                                                                     "timestamp": response["timestamp"]},
+                                                         response["data"])
+            except ImportError as e:
+                self.error = True
+                self.clean = {"error": str(e)}
+        with METRICS.stage('write'), open(self.path, "w") as outf:
             json.dump(self.get_json(), outf)
 
+    def append_dump(self):
+        """
+        Adds the fetched bars to the response at append_to, or writes it
+        whole if it holds no bars of these fields yet. If append_to is not
+        the request's own response, that one gets what was done.
+        """
+        target, self.append_to = self.append_to, None
+        with blbrg._append_locks.setdefault(os.path.abspath(target), threading.Lock()):
+            if self.newest is None:
+                path, self.path = self.path, target
+                try:
+                    self.get_dump()
+                finally:
+                    self.path = path
+                if self.error:
+                    return None if self.session_lost and self.session is not None else self.get_dump()
+                added = None
+            else:
+                header = self.get_json()
+                try:
+                    with METRICS.stage('write'):
+                        added = prepend_rows(target, {"security": header["security"],
+                                                      "timestamp": header["timestamp"]}, self.clean)
+                except (OSError, ValueError) as e:
+                    self.error = True
+                    self.clean = {"error": str(e)}
+                    return self.get_dump()
+            newest = newest_date(target, ['date'] + self.attributes)
+        if os.path.abspath(target) != os.path.abspath(self.path):
+            with open(self.path, "w") as outf:
+                json.dump({"security": self.ticker,
+                           "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+                           "data": {"append_to": os.path.abspath(target), "added": added, "newest": newest}}, outf)
+
+    def parse_chunk(self, messages):
+        self._raw = None
+        self.messages = messages
+        return self.parse()
+
+    def stream_dump(self):
+        """
+        Fetches the chunks of a long historical range, latest first and
+        PARALLEL_CHUNKS at a time, and appends each cleaned chunk to the
+        response as it arrives. Memory is bounded by one window of chunks
+        however long the range. On an error the usual error response is
+        written instead, unless the borrowed session was lost: nothing is
+        written then, the caller retries on a new session or calls
+        get_dump again to write the error.
+        """
+        ranges = self.chunks(self.start_date, self.end_date)[::-1]
+        writer = JsonColumnWriter(self.path,
+                                  {"security": self.ticker,
+                                   "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat()},
+                                  ['date'] + self.attributes)
+        try:
+            for i in range(0, len(ranges), blbrg.PARALLEL_CHUNKS):
+                window = ranges[i:i + blbrg.PARALLEL_CHUNKS]
+                if blbrg.cache is not None:
+                    parsed = blbrg.cache.load_ranges(self, window)
+                else:
+                    with METRICS.stage('fetch'):
+                        window = self.get_chunks(self.attributes, window)
+                    parsed = [self.parse_chunk(messages) for messages in window] or [None]
+
+                for chunk in parsed:
+                    self.parsed = chunk
+                    if self.parsed is None or self.is_error():
+                        writer.abort()
+                        if self.parsed is None:
+                            self.error = True
+                            self.clean = {"error": self.raw}
+                        self.streamed = False
+                        if self.session_lost and self.session is not None:
+                            return
+                        return self.get_dump()
+                    with METRICS.stage('clean'):
+                        writer.append(self.clean_parsed())
+            with METRICS.stage('write'):
+                writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+
     @classmethod
     def from_dict(cls, **kwargs):
         attributes = "OPEN HIGH LOW PX_LAST VOLUME"
+        session = kwargs.get('session')
+        response_format = kwargs.get('format', 'json')
         if all(k in kwargs for k in ('kind', 'bloomberg_code', 'path')):
             error = False
 
@@ -196,6 +581,20 @@ class blbrg():
         except KeyError:
             return cls(ticker='ERROR', error=True, path=path)
 
+        if response_format not in FORMATS:
+            return cls(ticker='ERROR', error=True, path=path)
+
+        # appending to a response, by path next to this one or by dataset name
+        append_to = None
+        if 'append_to' in kwargs or 'dataset' in kwargs:
+            if not is_historic or response_format != 'json' \
+                    or ('dataset' in kwargs and blbrg.datasets is None):
+                return cls(ticker='ERROR', error=True, path=path)
+            if 'dataset' in kwargs:
+                append_to = os.path.join(blbrg.datasets, re.sub(r'[^\w.-]', '_', str(kwargs['dataset'])) + '.json')
+            else:
+                append_to = os.path.join(os.path.dirname(path), os.path.basename(str(kwargs['append_to'])))
+
         if is_historic and not error:
             try:
                 start_date = kwargs['start_date']
@@ -210,7 +609,10 @@ class blbrg():
                        start_date=start_date.replace('-',''),
                        end_date=end_date.replace('-',''),
                        path=path,
-                       error=error)
+                       error=error,
+                       session=session,
+                       response_format=response_format,
+                       append_to=append_to)
 
         if not is_historic and kwargs['kind'] == "real-time":
             return cls(ticker=ticker,
@@ -219,10 +621,87 @@ class blbrg():
                        start_date=None,
                        end_date=None,
                        path=path,
-                       error=error)
+                       error=error,
+                       session=session,
+                       response_format=response_format)
         else:
             return cls(ticker='ERROR', error=True, path=path)
 
+    @classmethod
+    def from_dicts(cls, request_jsons, session=None):
+        """
+        Real-time requests sharing the same fields served by one
+        ReferenceDataRequest. See blbrgBatch.
+        """
+        return blbrgBatch(request_jsons, session=session, loader=cls)
+
+
+class blbrgBatch(blbrg):
+    """
+    Several real-time securities with the same fields fetched in one
+    ReferenceDataRequest. The response is split by security and each
+    request gets its own blbrg built from its part of the raw response.
+    """
+    def __init__(self, request_jsons, session=None, loader=blbrg):
+        self.requests = request_jsons
+        self.session = session
+        self.session_lost = False
+        self.is_historic = False
+        self.start_date = self.end_date = None
+        self.attributes = request_jsons[0].get('attributes', "OPEN HIGH LOW PX_LAST VOLUME").split()
+        self.is_ohlc = not any([atr not in "OPEN HIGH LOW PX_LAST VOLUME".split() for atr in self.attributes])
+        self.securities = list(dict.fromkeys(r['bloomberg_code'] for r in request_jsons))
+
+        self._raw = None
+        self.getRaw()
+        parts = self.split() if self.messages and blbrg.PARSER == "element" else self.split_raw()
+        self.items = [loader(ticker=r['bloomberg_code'],
+                             attributes=r.get('attributes', "OPEN HIGH LOW PX_LAST VOLUME"),
+                             path=r['path'],
+                             response_format=r.get('format', 'json'),
+                             **parts.get(r['bloomberg_code'], {'raw': self.raw}))
+                      for r in request_jsons]
+
+    def split(self):
+        """
+        Parsed response by security as {security: {'parsed': SecurityData}}.
+        A response level error reaches every request.
+        """
+        with METRICS.stage('parse'):
+            response_error, securities = parse_messages(self.messages)
+        if response_error is not None:
+            return {security: {'parsed': SecurityData(security=security, error=response_error)}
+                    for security in self.securities}
+        return {security: {'parsed': parsed} for security, parsed in securities.items()}
+
+    def split_raw(self):
+        """
+        Cuts the raw response at each securityData block as
+        {security: {'raw': raw part}}. A response level error is
+        not split so it reaches every request.
+        """
+        if 'responseError = {' in self.raw:
+            return {}
+        parts = dict()
+        for part in self.raw.split("securityData = {")[1:]:
+            security = re.search('(security = ")(.*?)(")', part)
+            if security is not None:
+                parts[security.group(2)] = {'raw': "securityData = {" + part}
+        return parts
+
+    def get_dump(self):
+        """
+        Writes the response of every request. One that fails to be written
+        gets an error response, the others still get their data.
+        """
+        for item in self.items:
+            try:
+                item.get_dump()
+            except Exception as e:
+                METRICS.count('errors', type=type(e).__name__)
+                with open(item.path, "w") as outf:
+                    json.dump({"error": str(e)}, outf)
+
 class frequencyUpdater:
     def __init__(self, SLEEP_SECONDS_BASE, COUNTER_BASE):
         self.base_sleep = SLEEP_SECONDS_BASE
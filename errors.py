@@ -0,0 +1,28 @@
+"""Exceptions of the terminal side modules, importable without blpapi"""
+
+
+class SessionPoolError(Exception):
+    """
+    Exception raised when no session could be started
+    or borrowed from the pool in time.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Unable to provide a bloomberg session."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class SubscriptionError(Exception):
+    """
+    Exception raised when a subscription could not be started.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Unable to subscribe."):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,164 @@
+"""Asynchronous blpapi engine: many requests in flight on one event-handler session"""
+import concurrent.futures
+import threading
+
+from lazyImport import lazy_import
+from logger import *
+
+blpapi = lazy_import('blpapi')
+
+
+class SessionLostError(Exception):
+    """
+    Exception set on the futures of requests in flight
+    when the engine's session went down.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Bloomberg session lost."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class _Pending:
+    """Messages received so far for one correlation id sent on session."""
+    def __init__(self, session):
+        self.session = session
+        self.future = concurrent.futures.Future()
+        self.messages = list()
+
+
+class EventEngine:
+    """
+        One blpapi session in event-handler mode shared by every caller.
+
+        send() returns at once with a Future; any number of requests are
+        outstanding together, told apart by their CorrelationId. Messages
+        of PARTIAL_RESPONSE events are gathered per request and the future
+        gets the whole list when the final RESPONSE arrives. Callers block
+        on future.result() or await asyncio.wrap_future(future), without
+        a thread or a session of their own per request.
+
+        If the session goes down, the requests in flight fail with
+        SessionLostError and the next send() starts a new session.
+        Pass it to blbrg as its session (or to BloombergAdapter as engine).
+    """
+    SERVICE = "//blp/refdata"
+    SESSION_DOWN = ("SessionConnectionDown", "SessionTerminated", "SessionStartupFailure")
+    START_TIMEOUT_SECS = 30
+    REQUEST_TIMEOUT_SECS = 60
+
+    def __init__(self, host='localhost', port=8194, max_retries=3, session_factory=None):
+        self.host = host
+        self.port = port
+        self.max_retries = max_retries
+        self._session_factory = session_factory or blpapi.Session
+        self._lock = threading.Lock()
+        self._session = None
+        self._service = None
+        self._pending = dict()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def _connect(self):
+        """Starts a session in event-handler mode and waits for it to come up."""
+        started = threading.Event()
+        state = {'up': False}
+
+        def on_event(event, session):
+            if not started.is_set() and event.eventType() == blpapi.Event.SESSION_STATUS:
+                for msg in event:
+                    if str(msg.messageType()) == "SessionStarted":
+                        state['up'] = True
+                        started.set()
+                    elif str(msg.messageType()) in EventEngine.SESSION_DOWN:
+                        started.set()
+                return
+            self._on_event(event, session)
+
+        sessionOptions = blpapi.SessionOptions()
+        sessionOptions.setServerHost(self.host)
+        sessionOptions.setServerPort(self.port)
+        session = self._session_factory(sessionOptions, on_event)
+        if not session.start() or not started.wait(EventEngine.START_TIMEOUT_SECS) or not state['up']:
+            session.stop()
+            raise SessionLostError("Failed to start session.")
+        if not session.openService(EventEngine.SERVICE):
+            session.stop()
+            raise SessionLostError(f"Failed to open {EventEngine.SERVICE}")
+        LOGGER.info(' event engine session started.')
+        return session
+
+    def _ensure(self):
+        with self._lock:
+            if self._session is None:
+                self._session = self._connect()
+                self._service = self._session.getService(EventEngine.SERVICE)
+            return self._session
+
+    def createRequest(self, operation):
+        self._ensure()
+        return self._service.createRequest(operation)
+
+    def send(self, request):
+        """Sends request and returns a Future of its list of messages."""
+        session = self._ensure()
+        cid = blpapi.CorrelationId()
+        pending = _Pending(session)
+        self._pending[cid] = pending
+        try:
+            session.sendRequest(request, correlationId=cid)
+        except Exception as e:
+            self._pending.pop(cid, None)
+            pending.future.set_exception(e)
+        return pending.future
+
+    def cancel(self, future):
+        """
+            Gives up on the request of future (e.g. it timed out): it is
+            no longer in flight and its session is asked to drop it.
+        """
+        for cid, pending in list(self._pending.items()):
+            if pending.future is future and self._pending.pop(cid, None) is not None:
+                try:
+                    pending.session.cancel(cid)
+                except Exception:
+                    pass
+                future.cancel()
+                return
+
+    def _on_event(self, event, session):
+        """Runs on the blpapi dispatcher thread."""
+        event_type = event.eventType()
+        for msg in event:
+            if event_type == blpapi.Event.SESSION_STATUS and str(msg.messageType()) in EventEngine.SESSION_DOWN:
+                self._lost(session, str(msg.messageType()))
+                continue
+            for cid in msg.correlationIds():
+                pending = self._pending.get(cid)
+                if pending is None:
+                    continue
+                pending.messages.append(msg)
+                if event_type in (blpapi.Event.RESPONSE, blpapi.Event.REQUEST_STATUS) \
+                        and self._pending.pop(cid, None) is not None:
+                    pending.future.set_result(pending.messages)
+
+    def _lost(self, session, reason):
+        with self._lock:
+            if self._session is session:
+                self._session = None
+                self._service = None
+        LOGGER.warning(f' event engine session down: {reason}.')
+        for cid, pending in list(self._pending.items()):
+            if pending.session is session and self._pending.pop(cid, None) is not None:
+                pending.future.set_exception(SessionLostError(f"Bloomberg session lost: {reason}."))
+
+    def close(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.stop()
@@ -0,0 +1,660 @@
+"""
+    Fake blpapi stand-in.
+
+    Mimics the subset of the blpapi python API used by this package
+    (sessions, //blp/refdata requests, events, messages and elements) so
+    the server can be exercised and benchmarked without a terminal.
+
+    Usage:
+        import fakeBlpapi
+        fakeBlpapi.install()        # before blbrgPrice is imported
+        fakeBlpapi.BACKEND.session_latency = 0.05
+        fakeBlpapi.BACKEND.error_rate = 0.01
+
+    Sessions created with an eventHandler deliver their events to it from
+    a dispatcher thread, as blpapi does, instead of through nextEvent().
+    Session.subscribe sends random walk //blp/mktdata updates of the
+    subscribed fields every BACKEND.tick_interval seconds.
+"""
+import datetime as dt
+import itertools
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+
+
+class Exception(Exception):
+    pass
+
+
+class InvalidArgumentException(Exception):
+    pass
+
+
+class InvalidStateException(Exception):
+    pass
+
+
+class NotFoundException(Exception):
+    pass
+
+
+class Event:
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+
+    def __init__(self, event_type, messages=()):
+        self._type = event_type
+        self._messages = list(messages)
+
+    def eventType(self):
+        return self._type
+
+    def __iter__(self):
+        return iter(self._messages)
+
+
+class CorrelationId:
+    _counter = itertools.count(1)
+
+    def __init__(self, value=None):
+        self._value = next(CorrelationId._counter) if value is None else value
+
+    def value(self):
+        return self._value
+
+    def __eq__(self, other):
+        return isinstance(other, CorrelationId) and self._value == other._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __repr__(self):
+        return f'CorrelationId({self._value!r})'
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return f'"{value}"'
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    return repr(value)
+
+
+class Element:
+    """
+        Node of a request or message tree.
+        An element is either a scalar, a complex type (named children)
+        or an array (of scalars or complex elements).
+    """
+    SCALAR, COMPLEX, ARRAY = range(3)
+
+    def __init__(self, name, value=None, kind=None):
+        self._name = name
+        self._value = value
+        if kind is None:
+            kind = Element.SCALAR if value is not None else Element.COMPLEX
+        self._kind = kind
+        self._children = []
+
+    # tree building
+    def setElement(self, name, value):
+        for child in self._children:
+            if child._name == name:
+                child._value = value
+                return
+        self._children.append(Element(name, value))
+
+    def appendValue(self, value):
+        self._children.append(value)
+
+    def appendElement(self):
+        child = Element(self._name)
+        self._children.append(child)
+        return child
+
+    def addElement(self, name, kind=None):
+        child = Element(name, kind=kind)
+        self._children.append(child)
+        return child
+
+    # tree walking
+    def name(self):
+        return self._name
+
+    def isArray(self):
+        return self._kind == Element.ARRAY
+
+    def isComplexType(self):
+        return self._kind == Element.COMPLEX
+
+    def numValues(self):
+        if self._kind == Element.ARRAY:
+            return len(self._children)
+        return 0 if self._kind == Element.COMPLEX else 1
+
+    def numElements(self):
+        return len(self._children) if self._kind == Element.COMPLEX else 0
+
+    def hasElement(self, name):
+        return any(child._name == name for child in self._children
+                   if isinstance(child, Element)) and self._kind == Element.COMPLEX
+
+    def getElement(self, name):
+        for child in self._children:
+            if isinstance(child, Element) and child._name == name:
+                return child
+        raise NotFoundException(f'{name} not found in {self._name}')
+
+    def elements(self):
+        return iter(self._children) if self._kind == Element.COMPLEX else iter(())
+
+    def values(self):
+        if self._kind == Element.ARRAY:
+            return iter(self._children)
+        return iter((self._value,))
+
+    def getValue(self, index=0):
+        if self._kind == Element.ARRAY:
+            return self._children[index]
+        return self._value
+
+    def getValueAsElement(self, index=0):
+        return self._children[index]
+
+    def getValueAsString(self, index=0):
+        value = self.getValue(index)
+        return value.isoformat() if isinstance(value, (dt.date, dt.datetime)) else str(value)
+
+    def getValueAsFloat(self, index=0):
+        return float(self.getValue(index))
+
+    def getElementAsString(self, name):
+        return self.getElement(name).getValueAsString()
+
+    def _lines(self, level):
+        pad = '    ' * level
+        if self._kind == Element.SCALAR:
+            return [f'{pad}{self._name} = {_format_value(self._value)}']
+        head = f'{pad}{self._name}[] = {{' if self._kind == Element.ARRAY else f'{pad}{self._name} = {{'
+        lines = [head]
+        for child in self._children:
+            if isinstance(child, Element):
+                lines += child._lines(level + 1)
+            else:
+                lines.append(f'{pad}    {_format_value(child)}')
+        lines.append(f'{pad}}}')
+        return lines
+
+    def toString(self):
+        return '\n'.join(self._lines(0)) + '\n'
+
+    __str__ = toString
+
+
+class Message:
+    def __init__(self, message_type, element=None, correlation_ids=()):
+        self._type = message_type
+        self._element = element if element is not None else Element(message_type)
+        self._cids = list(correlation_ids)
+
+    def messageType(self):
+        return self._type
+
+    def correlationIds(self):
+        return list(self._cids)
+
+    def asElement(self):
+        return self._element
+
+    def hasElement(self, name):
+        return self._element.hasElement(name)
+
+    def getElement(self, name):
+        return self._element.getElement(name)
+
+    def __str__(self):
+        return self._element.toString()
+
+
+class Request:
+    def __init__(self, operation):
+        self._operation = operation
+        self._element = Element(operation)
+        self._element._children += [Element('securities', kind=Element.ARRAY),
+                                    Element('fields', kind=Element.ARRAY)]
+
+    def operation(self):
+        return self._operation
+
+    def getElement(self, name):
+        return self._element.getElement(name)
+
+    def set(self, name, value):
+        self._element.setElement(name, value)
+
+    def get(self, name, default=None):
+        try:
+            return self._element.getElement(name).getValue()
+        except NotFoundException:
+            return default
+
+    def __str__(self):
+        return self._element.toString()
+
+
+class Service:
+    OPERATIONS = ("ReferenceDataRequest", "HistoricalDataRequest")
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def createRequest(self, operation):
+        if operation not in Service.OPERATIONS:
+            raise NotFoundException(f'{operation} is not an operation of {self._name}')
+        return Request(operation)
+
+
+class SubscriptionList:
+    def __init__(self):
+        self._entries = []
+
+    def add(self, topic, fields=None, options=None, correlationId=None):
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        self._entries.append((topic, [f.strip() for f in fields or ()], correlationId or CorrelationId()))
+
+    def size(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+
+class SessionOptions:
+    def __init__(self):
+        self._host = 'localhost'
+        self._port = 8194
+
+    def setServerHost(self, host):
+        self._host = host
+
+    def setServerPort(self, port):
+        self._port = port
+
+    def serverHost(self):
+        return self._host
+
+    def serverPort(self):
+        return self._port
+
+
+class FakeBackend:
+    """
+        Data model behind every fake session.
+
+        session_latency -- seconds spent by Session.start() + openService()
+        request_latency -- median seconds before a response event is delivered
+        latency_sigma -- spread of the lognormal request latency, 0 for a fixed one
+        row_latency -- extra seconds per returned row or field, large payloads come later
+        error_rate -- share of securities answered with a securityError
+        partial_size -- securities (reference) or rows (historical) per message,
+                        all but the last message come as PARTIAL_RESPONSE events
+        tick_interval -- seconds between //blp/mktdata updates of a subscription
+        fail_start -- makes Session.start() return False (terminal down)
+        seed -- seed of the latency and error draws
+
+        Historical fields starting with one of SPARSE (split factors,
+        estimates, dividends) are only reported on one day in SPARSE_DAYS.
+    """
+    CURRENCY = "USD"
+    SPARSE = ('EQY_SPLIT', 'BEST_', 'DVD_')
+    SPARSE_DAYS = 20
+
+    def __init__(self, session_latency=0.0, request_latency=0.0, fail_start=False,
+                 latency_sigma=0.0, row_latency=0.0, error_rate=0.0, partial_size=None, seed=0,
+                 tick_interval=0.1):
+        self.partial_size = partial_size
+        self.tick_interval = tick_interval
+        self.session_latency = session_latency
+        self.request_latency = request_latency
+        self.latency_sigma = latency_sigma
+        self.row_latency = row_latency
+        self.error_rate = error_rate
+        self.fail_start = fail_start
+        self.sessions_started = 0
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def _rng(*key):
+        return random.Random(zlib.crc32('|'.join(map(str, key)).encode()))
+
+    def value(self, security, field, day=None):
+        rng = self._rng(security, field, day)
+        if field == 'CRNCY':
+            return FakeBackend.CURRENCY
+        if field.endswith('_DT') or 'DATE' in field:
+            return dt.date(2021, 1, 4) + dt.timedelta(days=rng.randrange(365))
+        if field == 'VOLUME':
+            return float(rng.randrange(10 ** 5, 10 ** 8))
+        return round(rng.uniform(10, 500), 4)
+
+    def reported(self, security, field, day):
+        """Whether a historical row of day has a value of field."""
+        return not field.startswith(FakeBackend.SPARSE) \
+            or self._rng(security, field, day, 'reported').randrange(FakeBackend.SPARSE_DAYS) == 0
+
+    @staticmethod
+    def business_days(start, end):
+        day = dt.datetime.strptime(start, '%Y%m%d').date()
+        end = dt.datetime.strptime(end, '%Y%m%d').date()
+        while day <= end:
+            if day.weekday() < 5:
+                yield day
+            day += dt.timedelta(days=1)
+
+    @staticmethod
+    def _security_error(security):
+        error = Element('securityError')
+        error.setElement('source', 'fake')
+        error.setElement('code', 15)
+        error.setElement('category', 'BAD_SEC')
+        error.setElement('message', f'Unknown/Invalid security [{security}]')
+        error.setElement('subcategory', 'INVALID_SECURITY')
+        return error
+
+    @staticmethod
+    def is_valid(security):
+        return 'INVALID' not in security.upper()
+
+    def _failing(self, security):
+        if not self.error_rate:
+            return not self.is_valid(security)
+        with self._lock:
+            return self._random.random() < self.error_rate or not self.is_valid(security)
+
+    @staticmethod
+    def rows(messages):
+        """Number of values in a response: historical rows or reference fields."""
+        count = 0
+        for msg in messages:
+            securities = msg.getElement('securityData')
+            for data in securities.values() if securities.isArray() else (securities,):
+                if data.hasElement('fieldData'):
+                    field_data = data.getElement('fieldData')
+                    count += field_data.numValues() if field_data.isArray() else field_data.numElements()
+        return count
+
+    def latency(self, messages):
+        """Seconds before the response to messages is delivered."""
+        latency = self.request_latency
+        if latency and self.latency_sigma:
+            with self._lock:
+                latency *= self._random.lognormvariate(0, self.latency_sigma)
+        if self.row_latency:
+            latency += self.row_latency * self.rows(messages)
+        return latency
+
+    def _security_data(self, security, sequence):
+        data = Element('securityData')
+        data.setElement('security', security)
+        data.addElement('eidData', Element.ARRAY)
+        data.addElement('fieldExceptions', Element.ARRAY)
+        data.setElement('sequenceNumber', sequence)
+        return data
+
+    def reference(self, securities, fields, cid):
+        root = Element('ReferenceDataResponse')
+        array = root.addElement('securityData', Element.ARRAY)
+        for sequence, security in enumerate(securities):
+            data = self._security_data(security, sequence)
+            if self._failing(security):
+                data._children.append(self._security_error(security))
+            else:
+                field_data = data.addElement('fieldData')
+                for field in fields:
+                    field_data.setElement(field, self.value(security, field))
+            array._children.append(data)
+        return [Message('ReferenceDataResponse', root, (cid,))]
+
+    def historical(self, securities, fields, start, end, cid):
+        messages = []
+        for sequence, security in enumerate(securities):
+            root = Element('HistoricalDataResponse')
+            data = self._security_data(security, sequence)
+            root._children.append(data)
+            if self._failing(security):
+                data._children.append(self._security_error(security))
+            else:
+                rows = data.addElement('fieldData', Element.ARRAY)
+                for day in self.business_days(start, end):
+                    row = rows.appendElement()
+                    row.setElement('date', day)
+                    for field in fields:
+                        if self.reported(security, field, day):
+                            row.setElement(field, self.value(security, field, day))
+            messages.append(Message('HistoricalDataResponse', root, (cid,)))
+        return messages
+
+    def respond(self, request, cid):
+        securities = list(request.getElement('securities').values())
+        fields = list(request.getElement('fields').values())
+        with self._lock:
+            self.requests_served += 1
+        if request.operation() == 'HistoricalDataRequest':
+            return self.historical(securities, fields, request.get('startDate'), request.get('endDate'), cid)
+        return self.reference(securities, fields, cid)
+
+
+    def _split(self, msg):
+        """Message cut into messages of at most partial_size securities or rows."""
+        size = self.partial_size
+        root = msg.asElement()
+        data = root.getElement('securityData')
+        if data.isArray():
+            items = data._children
+        elif data.hasElement('fieldData'):
+            items = data.getElement('fieldData')._children
+        else:
+            return [msg]
+
+        messages = []
+        for i in range(0, max(len(items), 1), size):
+            part = Element(root.name())
+            if data.isArray():
+                part.addElement('securityData', Element.ARRAY)._children = items[i:i + size]
+            else:
+                copy = part.addElement('securityData')
+                for child in data._children:
+                    if child._name == 'fieldData':
+                        copy.addElement('fieldData', Element.ARRAY)._children = items[i:i + size]
+                    else:
+                        copy._children.append(child)
+            messages.append(Message(msg.messageType(), part, msg.correlationIds()))
+        return messages
+
+    def events(self, request, cid):
+        """Events answering a request: PARTIAL_RESPONSE ones then the final RESPONSE."""
+        messages = self.respond(request, cid)
+        if not self.partial_size:
+            return [Event(Event.RESPONSE, messages)]
+        messages = [part for msg in messages for part in self._split(msg)]
+        return [Event(Event.PARTIAL_RESPONSE, [msg]) for msg in messages[:-1]] + \
+            [Event(Event.RESPONSE, messages[-1:])]
+
+
+BACKEND = FakeBackend()
+
+
+class Session:
+    def __init__(self, options=None, eventHandler=None, eventDispatcher=None, backend=None):
+        self._options = options if options is not None else SessionOptions()
+        self._backend = backend if backend is not None else BACKEND
+        self._events = queue.Queue()
+        self._services = {}
+        self._started = False
+        self._subscriptions = {}
+        self._timers = {}
+        self._ticker = None
+        self._handler = eventHandler
+        if eventHandler is not None:
+            threading.Thread(target=self._dispatch, name='fake_blpapi_dispatcher', daemon=True).start()
+
+    def _dispatch(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            self._handler(event, self)
+
+    def _status(self, event_type, message_type):
+        self._events.put(Event(event_type, [Message(message_type)]))
+
+    def start(self):
+        time.sleep(self._backend.session_latency / 2)
+        if self._backend.fail_start:
+            self._status(Event.SESSION_STATUS, 'SessionStartupFailure')
+            return False
+        with self._backend._lock:
+            self._backend.sessions_started += 1
+        self._started = True
+        self._status(Event.SESSION_STATUS, 'SessionConnectionUp')
+        self._status(Event.SESSION_STATUS, 'SessionStarted')
+        return True
+
+    def stop(self):
+        if self._started:
+            self._started = False
+            self._services = {}
+            self._status(Event.SESSION_STATUS, 'SessionTerminated')
+        if self._handler is not None:
+            self._events.put(None)
+        return True
+
+    def openService(self, name):
+        if not self._started:
+            return False
+        time.sleep(self._backend.session_latency / 2)
+        self._services[name] = Service(name)
+        self._status(Event.SERVICE_STATUS, 'ServiceOpened')
+        return True
+
+    def getService(self, name):
+        if not self._started:
+            raise InvalidStateException('session not started')
+        try:
+            return self._services[name]
+        except KeyError:
+            raise NotFoundException(f'service {name} not opened')
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=""):
+        if not self._started:
+            raise InvalidStateException('session not started')
+        cid = correlationId if correlationId is not None else CorrelationId()
+        events = self._backend.events(request, cid)
+        latency = self._backend.latency([msg for event in events for msg in event])
+
+        def deliver():
+            self._timers.pop(cid, None)
+            for event in events:
+                self._events.put(event)
+
+        if latency > 0:
+            self._timers[cid] = threading.Timer(latency, deliver)
+            self._timers[cid].start()
+        else:
+            deliver()
+        return cid
+
+    def cancel(self, correlationId):
+        """No event is delivered for a request not answered yet."""
+        timer = self._timers.pop(correlationId, None)
+        if timer is not None:
+            timer.cancel()
+
+    def nextEvent(self, timeout=0):
+        if self._handler is not None:
+            raise InvalidStateException('nextEvent is not available with an eventHandler')
+        try:
+            return self._events.get(timeout=timeout / 1000 if timeout else None)
+        except queue.Empty:
+            return Event(Event.TIMEOUT)
+
+    def tryNextEvent(self):
+        if self._handler is not None:
+            raise InvalidStateException('tryNextEvent is not available with an eventHandler')
+        try:
+            return self._events.get_nowait()
+        except queue.Empty:
+            return None
+
+    def subscribe(self, subscriptionList, identity=None, requestLabel=""):
+        """Starts //blp/mktdata updates: SUBSCRIPTION_DATA events every tick_interval seconds."""
+        if not self._started:
+            raise InvalidStateException('session not started')
+        for topic, fields, cid in subscriptionList:
+            security = topic.split('?')[0].replace('//blp/mktdata/', '')
+            if not self._backend.is_valid(security):
+                failure = Element('SubscriptionFailure')
+                failure.addElement('reason').setElement('description', f'Unknown/Invalid security [{security}]')
+                self._events.put(Event(Event.SUBSCRIPTION_STATUS, [Message('SubscriptionFailure', failure, (cid,))]))
+                continue
+            last = {field: self._backend.value(security, field) for field in fields}
+            self._subscriptions[cid] = (security, fields, last)
+            self._events.put(Event(Event.SUBSCRIPTION_STATUS, [Message('SubscriptionStarted', None, (cid,))]))
+            # initial paint: every field once
+            element = Element('MarketDataEvents')
+            for field, value in last.items():
+                element.setElement(field, value)
+            self._events.put(Event(Event.SUBSCRIPTION_DATA, [Message('MarketDataEvents', element, (cid,))]))
+        if self._ticker is None:
+            self._ticker = threading.Thread(target=self._tick, name='fake_blpapi_ticker', daemon=True)
+            self._ticker.start()
+
+    def unsubscribe(self, subscriptionList):
+        for _, _, cid in subscriptionList:
+            if self._subscriptions.pop(cid, None) is not None:
+                self._events.put(Event(Event.SUBSCRIPTION_STATUS, [Message('SubscriptionTerminated', None, (cid,))]))
+
+    def _tick(self):
+        rng = random.Random()
+        while self._started:
+            time.sleep(self._backend.tick_interval)
+            for cid, (security, fields, last) in list(self._subscriptions.items()):
+                element = Element('MarketDataEvents')
+                for field in fields:
+                    if isinstance(last[field], float) and rng.random() < 0.7:
+                        last[field] = round(last[field] * (1 + rng.gauss(0, 0.001)), 4)
+                        element.setElement(field, last[field])
+                self._events.put(Event(Event.SUBSCRIPTION_DATA, [Message('MarketDataEvents', element, (cid,))]))
+        self._ticker = None
+
+    def terminate(self):
+        """Simulates the terminal dropping the connection."""
+        self._started = False
+        self._services = {}
+        self._status(Event.SESSION_STATUS, 'SessionConnectionDown')
+        self._status(Event.SESSION_STATUS, 'SessionTerminated')
+
+
+def install():
+    """Registers this module as `blpapi` for every later import."""
+    sys.modules['blpapi'] = sys.modules[__name__]
+    return sys.modules[__name__]
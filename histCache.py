@@ -0,0 +1,217 @@
+"""On-disk cache of historical bars per (ticker, field) with gap-only fetching"""
+import datetime as dt
+import json
+import os
+import re
+import threading
+import time
+
+from blbrgParser import SecurityData
+from logger import *
+from metrics import METRICS
+
+
+def to_day(date):
+    """datetime.date of a YYYYMMDD or YYYY-MM-DD string."""
+    return dt.date.fromisoformat(date) if '-' in date else dt.datetime.strptime(date, '%Y%m%d').date()
+
+
+def business_range(start, end):
+    """start/end rolled inwards to business days (Monday to Friday), None if no business day in between."""
+    if start.weekday() > 4:
+        start += dt.timedelta(days=7 - start.weekday())
+    if end.weekday() > 4:
+        end -= dt.timedelta(days=end.weekday() - 4)
+    return (start, end) if start <= end else None
+
+
+def subtract(start, end, covered):
+    """Sub-ranges of [start, end] not in the sorted, merged covered ranges."""
+    gaps = []
+    for covered_start, covered_end in covered:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            gaps.append((start, covered_start - dt.timedelta(days=1)))
+        start = max(start, covered_end + dt.timedelta(days=1))
+    if start <= end:
+        gaps.append((start, end))
+    return gaps
+
+
+def merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + dt.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class HistoricalCache:
+    """
+        Persistent per (ticker, field) daily series.
+
+        Every entry records which date ranges were already fetched, so a
+        request only fetches the business day ranges it is missing.
+        Today is never marked as fetched as its bar is not final.
+        Least recently used entries are evicted beyond max_bytes.
+    """
+    MAX_BYTES = 512 * 1024 ** 2
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._sizes = dict()
+        self._used = dict()
+
+        os.makedirs(directory, exist_ok=True)
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.json'):
+                stat = os.stat(os.path.join(directory, file_name))
+                self._sizes[file_name] = stat.st_size
+                self._used[file_name] = stat.st_mtime
+        self._evict()
+
+    @staticmethod
+    def file_name(ticker, field):
+        return re.sub(r'[^\w.-]', '_', f'{ticker}__{field}') + '.json'
+
+    def _entry(self, ticker, field):
+        file_name = self.file_name(ticker, field)
+        self._used[file_name] = time.time()
+        if file_name not in self._entries:
+            try:
+                with open(os.path.join(self.directory, file_name), 'r') as inf:
+                    entry = json.load(inf)
+                entry['covered'] = [tuple(map(dt.date.fromisoformat, r)) for r in entry['covered']]
+            except (OSError, ValueError, KeyError):
+                entry = {'ticker': ticker, 'field': field, 'fetched': dt.date.today().isoformat(),
+                         'covered': [], 'bars': {}}
+            self._entries[file_name] = entry
+        return self._entries[file_name]
+
+    def _write(self, file_name):
+        entry = self._entries[file_name]
+        path = os.path.join(self.directory, file_name)
+        # the temporary name is per process as worker processes share the directory
+        with open(f'{path}.{os.getpid()}.tmp', 'w') as outf:
+            json.dump({**entry, 'covered': [[s.isoformat(), e.isoformat()] for s, e in entry['covered']]}, outf)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+        self._sizes[file_name] = os.path.getsize(path)
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        for file_name in sorted(self._sizes, key=lambda f: self._used.get(f, 0)):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(file_name)
+            self._drop(file_name)
+            LOGGER.info(f' historical cache evicted {file_name}.')
+
+    def _drop(self, file_name):
+        self._entries.pop(file_name, None)
+        self._used.pop(file_name, None)
+        self._sizes.pop(file_name, None)
+        try:
+            os.remove(os.path.join(self.directory, file_name))
+        except OSError:
+            pass
+
+    def gaps(self, ticker, fields, start, end):
+        """Business day ranges of [start, end] missing for any of the fields."""
+        with self._lock:
+            missing = [gap for field in fields
+                       for gap in subtract(start, end, self._entry(ticker, field)['covered'])]
+        return [gap for gap in map(lambda g: business_range(*g), merge(missing)) if gap is not None]
+
+    def store(self, ticker, fields, rows, start, end):
+        """Merges fetched rows in and marks [start, end] as fetched (up to yesterday)."""
+        end = min(end, dt.date.today() - dt.timedelta(days=1))
+        with self._lock:
+            for field in fields:
+                entry = self._entry(ticker, field)
+                for row in rows:
+                    if field in row:
+                        value = row[field]
+                        entry['bars'][str(row['date'])] = value.isoformat() if isinstance(value, dt.date) else value
+                if start <= end:
+                    entry['covered'] = merge(entry['covered'] + [(start, end)])
+                self._write(self.file_name(ticker, field))
+            self._evict()
+
+    def rows(self, ticker, fields, start, end):
+        """Rows of [start, end] in date order, as the parser returns them."""
+        start, end = start.isoformat(), end.isoformat()
+        with self._lock:
+            bars = {field: self._entry(ticker, field)['bars'] for field in fields}
+        days = sorted({day for series in bars.values() for day in series if start <= day <= end})
+        return [{'date': dt.date.fromisoformat(day),
+                 **{field: bars[field][day] for field in fields if day in bars[field]}} for day in days]
+
+    def load(self, loader, start_date=None, end_date=None):
+        """
+            SecurityData of a historical blbrg request served from the cache,
+            between its own dates unless other YYYYMMDD dates are given.
+        """
+        return self.load_ranges(loader, [(start_date or loader.start_date, end_date or loader.end_date)])[0]
+
+    def load_ranges(self, loader, ranges):
+        """
+            SecurityData of each YYYYMMDD (start, end) range of a historical
+            blbrg request. The ranges missing for any of them are fetched
+            together through loader.fetch_ranges. An unparsed or failed
+            fetch is returned alone, as is, and not cached.
+        """
+        days = [(to_day(start_date), to_day(end_date)) for start_date, end_date in ranges]
+        gaps = list()
+        for start, end in days:
+            missing = self.gaps(loader.ticker, loader.attributes, start, end)
+            METRICS.count('cache_lookups', cache='historical', result='partial' if missing else 'hit')
+            gaps += missing
+        fetched = loader.fetch_ranges([(gap_start.strftime('%Y%m%d'), gap_end.strftime('%Y%m%d'))
+                                       for gap_start, gap_end in gaps]) if gaps else []
+        for (gap_start, gap_end), parsed in zip(gaps, fetched):
+            if parsed is None or parsed.error or parsed.field_exceptions:
+                return [parsed]
+            self.store(loader.ticker, loader.attributes, parsed.rows, gap_start, gap_end)
+            LOGGER.info(f' historical cache fetched {loader.ticker} {gap_start} - {gap_end}.')
+        return [SecurityData(security=loader.ticker, rows=self.rows(loader.ticker, loader.attributes, start, end))
+                for start, end in days]
+
+    def invalidate(self, ticker, field=None):
+        """Drops the cached series of a ticker (all fields by default)."""
+        with self._lock:
+            prefix = self.file_name(ticker, '')[:-len('.json')]
+            for file_name in list(self._sizes) + list(self._entries):
+                if file_name == self.file_name(ticker, field) or (field is None and file_name.startswith(prefix)):
+                    self._drop(file_name)
+
+    def invalidate_split(self, ticker, split_date):
+        """
+            Drops the series of a ticker fetched before its split date,
+            as Bloomberg adjusts every bar before a split.
+        """
+        split_date = str(split_date)
+        if split_date > dt.date.today().isoformat():
+            return
+        with self._lock:
+            prefix = self.file_name(ticker, '')[:-len('.json')]
+            stale = [file_name for file_name in list(self._sizes) + list(self._entries)
+                     if file_name.startswith(prefix) and self._entry_fetched(file_name) < split_date]
+            for file_name in stale:
+                self._drop(file_name)
+        if stale:
+            LOGGER.info(f' historical cache invalidated {ticker} after split on {split_date}.')
+
+    def _entry_fetched(self, file_name):
+        if file_name not in self._entries:
+            try:
+                with open(os.path.join(self.directory, file_name), 'r') as inf:
+                    return json.load(inf)['fetched']
+            except (OSError, ValueError, KeyError):
+                return ''
+        return self._entries[file_name]['fetched']
@@ -0,0 +1,244 @@
+"""
+    Spool janitor: retention of uncollected responses and compaction of
+    requests_debug/ into compressed, append-only archive segments.
+
+    Query the archive:
+        python janitor.py --name AAPL_1.json
+        python janitor.py --ticker "AAPL US Equity" --limit 5
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRICS
+from logger import *
+
+
+class Janitor:
+    """
+        Keeps the spool directories small.
+
+        sweep_responses() deletes responses older than response_max_age
+        seconds, then the oldest beyond response_max_count: clients delete
+        the responses they collect, the ones left were never collected.
+
+        compact() moves debug requests older than archive_after seconds
+        into segment files of archive_dir: blocks of up to BLOCK_RECORDS
+        requests, each block one gzip member appended to the current
+        segment (so `zcat segment_*.gz` reads them all), a new segment
+        once it reaches segment_bytes. An sqlite index maps request names
+        and tickers to (segment, offset, length, position) of their block.
+        A file is only removed once its block is written and indexed.
+    """
+    RESPONSE_MAX_AGE_SECS = 7 * 24 * 3600
+    RESPONSE_MAX_COUNT = 100000
+    ARCHIVE_AFTER_SECS = 3600
+    SEGMENT_BYTES = 64 * 1024 ** 2
+    BLOCK_RECORDS = 1000
+    INTERVAL_SECS = 300
+    INDEX = 'index.sqlite'
+    IN_PROGRESS = ('.part', '.tmp')
+
+    def __init__(self, responses, debug, archive_dir, response_max_age=RESPONSE_MAX_AGE_SECS,
+                 response_max_count=RESPONSE_MAX_COUNT, archive_after=ARCHIVE_AFTER_SECS,
+                 segment_bytes=SEGMENT_BYTES):
+        self.responses = responses
+        self.debug = debug
+        self.archive_dir = archive_dir
+        self.response_max_age = response_max_age
+        self.response_max_count = response_max_count
+        self.archive_after = archive_after
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS archive (name TEXT, ticker TEXT, kind TEXT, mtime REAL, '
+                       'segment TEXT, offset INTEGER, length INTEGER, position INTEGER)')
+            db.execute('CREATE INDEX IF NOT EXISTS archive_name ON archive (name)')
+            db.execute('CREATE INDEX IF NOT EXISTS archive_ticker ON archive (ticker)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(self.archive_dir, Janitor.INDEX), timeout=30)
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _files(directory):
+        """(name, last change time) of the finished files of directory."""
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(Janitor.IN_PROGRESS):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.is_file():
+                    # a rename into the directory changes ctime only (on posix)
+                    yield entry.name, max(stat.st_mtime, stat.st_ctime)
+
+    def sweep_responses(self, now=None):
+        """Deletes the expired responses, returns how many."""
+        now = now or time.time()
+        files = sorted(self._files(self.responses), key=lambda item: item[1])
+        excess = max(0, len(files) - self.response_max_count) if self.response_max_count is not None else 0
+        deleted = 0
+        for idx, (name, changed) in enumerate(files):
+            if idx >= excess and now - changed <= self.response_max_age:
+                break
+            try:
+                os.remove(os.path.join(self.responses, name))
+                deleted += 1
+            except OSError:
+                pass
+        if deleted:
+            LOGGER.info(f' janitor deleted {deleted} uncollected responses.')
+            METRICS.count('janitor_files', deleted, action='deleted')
+        return deleted
+
+    def _segment(self):
+        """Path of the segment to append to, a new one once the last is full."""
+        segments = sorted(name for name in os.listdir(self.archive_dir) if name.startswith('segment_'))
+        if segments:
+            last = os.path.join(self.archive_dir, segments[-1])
+            if os.path.getsize(last) < self.segment_bytes:
+                return last
+            number = int(segments[-1][len('segment_'):-len('.gz')]) + 1
+        else:
+            number = 1
+        return os.path.join(self.archive_dir, f'segment_{number:06d}.gz')
+
+    @staticmethod
+    def _describe(text):
+        """[(ticker, kind)] of the requests of a .json or .jsonl request file's text."""
+        try:
+            contents = [json.loads(text)]
+        except ValueError:
+            contents = list()
+            for line in text.splitlines():
+                try:
+                    contents.append(json.loads(line))
+                except ValueError:
+                    continue
+        return [(content.get('bloomberg_code'), content.get('kind'))
+                for content in contents if isinstance(content, dict)] or [(None, None)]
+
+    def _archive_block(self, db, block):
+        """Appends one block of (name, changed, text) and indexes it."""
+        data = gzip.compress(''.join(json.dumps({'name': name, 'mtime': changed, 'content': text}) + '\n'
+                                     for name, changed, text in block).encode())
+        segment = self._segment()
+        with open(segment, 'ab') as outf:
+            offset = outf.tell()
+            outf.write(data)
+            outf.flush()
+            os.fsync(outf.fileno())
+        db.executemany('INSERT INTO archive VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       [(name, ticker, kind, changed, os.path.basename(segment), offset, len(data), position)
+                        for position, (name, changed, text) in enumerate(block)
+                        for ticker, kind in self._describe(text)])
+        db.commit()
+
+    def compact(self, now=None):
+        """Archives the debug requests older than archive_after, returns how many."""
+        now = now or time.time()
+        names = sorted((name for name, changed in self._files(self.debug) if now - changed > self.archive_after))
+        archived = 0
+        with self._lock, self._connect() as db:
+            for i in range(0, len(names), Janitor.BLOCK_RECORDS):
+                block = list()
+                for name in names[i:i + Janitor.BLOCK_RECORDS]:
+                    path = os.path.join(self.debug, name)
+                    try:
+                        changed = max(os.stat(path).st_mtime, os.stat(path).st_ctime)
+                        with open(path, 'r', encoding='utf-8', errors='replace') as inf:
+                            block.append((name, changed, inf.read()))
+                    except OSError:
+                        continue
+                if not block:
+                    continue
+                self._archive_block(db, block)
+                for name, _, _ in block:
+                    try:
+                        os.remove(os.path.join(self.debug, name))
+                    except OSError:
+                        LOGGER.warning(f' janitor unable to delete {name}.')
+                archived += len(block)
+        if archived:
+            LOGGER.info(f' janitor archived {archived} requests.')
+            METRICS.count('janitor_files', archived, action='archived')
+        return archived
+
+    def find(self, name=None, ticker=None, limit=100):
+        """
+            Archived requests by file name and/or ticker, latest first:
+            [{"name", "mtime", "segment", "content"}], content parsed if it
+            is JSON. A .jsonl file is returned whole.
+        """
+        where, args = list(), list()
+        if name is not None:
+            where.append('name = ?')
+            args.append(name)
+        if ticker is not None:
+            where.append('ticker = ?')
+            args.append(ticker)
+        query = 'SELECT DISTINCT segment, offset, length, position, mtime FROM archive' + \
+                (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY mtime DESC LIMIT ?'
+        with self._connect() as db:
+            rows = db.execute(query, args + [limit]).fetchall()
+
+        blocks = dict()
+        found = list()
+        for segment, offset, length, position, _ in rows:
+            if (segment, offset) not in blocks:
+                with open(os.path.join(self.archive_dir, segment), 'rb') as inf:
+                    inf.seek(offset)
+                    blocks[(segment, offset)] = gzip.decompress(inf.read(length)).decode().splitlines()
+            record = json.loads(blocks[(segment, offset)][position])
+            try:
+                record['content'] = json.loads(record['content'])
+            except ValueError:
+                pass
+            found.append({**record, 'segment': segment})
+        return found
+
+    def run_once(self):
+        for task in (self.sweep_responses, self.compact):
+            try:
+                task()
+            except Exception as e:
+                LOGGER.error(f' janitor {task.__name__} failed: {e!r}')
+
+    def start(self, interval=INTERVAL_SECS):
+        """Runs sweep_responses and compact every interval seconds from a daemon thread."""
+        def loop():
+            while True:
+                self.run_once()
+                time.sleep(interval)
+        threading.Thread(target=loop, name='janitor', daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Looks up archived request files.")
+    parser.add_argument('--archive', default='archive', help="archive directory")
+    parser.add_argument('--name', help="request file name")
+    parser.add_argument('--ticker', help="bloomberg_code of the request")
+    parser.add_argument('--limit', type=int, default=100)
+    options = parser.parse_args()
+    if options.name is None and options.ticker is None:
+        parser.error("give --name and/or --ticker")
+    if not os.path.exists(os.path.join(options.archive, Janitor.INDEX)):
+        parser.error(f"no archive index in {options.archive}")
+    archive = Janitor(None, None, options.archive)
+    for record in archive.find(name=options.name, ticker=options.ticker, limit=options.limit):
+        print(json.dumps(record))
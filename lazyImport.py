@@ -0,0 +1,33 @@
+"""Deferred imports of the heavy dependencies (numpy, pyarrow, blpapi)"""
+import importlib
+import importlib.util
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """
+        Stand-in for a module not imported yet: the first attribute looked
+        up imports it. The import itself is a regular one, so threads
+        looking up attributes at the same time wait for it to complete
+        (importlib.util.LazyLoader lets them see a half executed module).
+    """
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # later lookups find the attributes here, without __getattr__
+        self.__dict__.update({key: value for key, value in vars(module).items() if key not in self.__dict__})
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """
+        Module `name`, only executed when one of its attributes is first
+        used. Raises ImportError at once if it is not installed, like an
+        import statement. A module already imported (or installed in
+        sys.modules, like fakeBlpapi) is returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
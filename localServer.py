@@ -0,0 +1,234 @@
+"""Local Unix socket and HTTP front-end sharing the adapter and scheduler of the spool directories"""
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from pRequests import Request
+from metrics import METRICS
+from logger import *
+
+
+class LocalServer:
+    """
+        Serves the request JSON of the requests directory over a local
+        connection, without the spool round trip. Requests go through the
+        same adapter (so the same caches) and, if given, the same scheduler
+        and priorities as the request files.
+
+        Unix socket: one request JSON per line, each answered by one JSON
+        line as soon as it completes, with the "line" number of its request
+        on the connection.
+        HTTP: POST / with one request JSON returns its response as the body
+        (npz and arrow formats as application/octet-stream). A body of
+        application/x-ndjson requests is answered like the Unix socket,
+        streamed in chunks.
+
+        Lines of many requests are always answered in JSON.
+    """
+    FORMAT_ERROR = {"error": "JSON format error."}
+    NDJSON = 'application/x-ndjson'
+
+    def __init__(self, adapter, scheduler=None):
+        self.adapter = adapter
+        self.scheduler = scheduler
+        self.loop = None
+        self._parts = tempfile.mkdtemp(prefix='bploader_socket_')
+        self._ids = itertools.count(1)
+        self._servers = list()
+        self._started = threading.Event()
+
+    async def fetch(self, content):
+        """Response bytes of one request, fetched by the adapter on the scheduler if any."""
+        requestTag = f'socket#{next(self._ids)}'
+        path = os.path.join(self._parts, requestTag.replace('#', '.'))
+        request = Request(mtime=time.time(), content=content)
+        METRICS.count('socket_requests', kind=request.kind)
+        loop = asyncio.get_running_loop()
+
+        def dump(requestTags):
+            with METRICS.stage('adapter'):
+                self.adapter.create_dump({**content, 'path': path})
+
+        if self.scheduler is None:
+            try:
+                await loop.run_in_executor(None, dump, [requestTag])
+            except Exception as e:
+                return json.dumps({"error": str(e)}).encode()
+        else:
+            done = loop.create_future()
+            def finished(requestTags, e):
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(e))
+            while not self.scheduler.submit([requestTag], dump, finished,
+                                            priority=request.sort_index, kind=request.kind):
+                await asyncio.sleep(0.01)
+            error = await done
+            if error is not None:
+                return json.dumps({"error": str(error)}).encode()
+
+        try:
+            with open(path, 'rb') as inf:
+                response = inf.read()
+            os.remove(path)
+        except OSError:
+            response = json.dumps({"error": "No response."}).encode()
+        METRICS.count('responses')
+        return response
+
+    async def fetch_json(self, text):
+        """Response dict of one request JSON text, always in JSON."""
+        try:
+            content = json.loads(text)
+        except ValueError:
+            content = None
+        if not isinstance(content, dict):
+            METRICS.count('errors', type='json_format')
+            return dict(LocalServer.FORMAT_ERROR)
+        content.pop('format', None)
+        return json.loads(await self.fetch(content))
+
+    async def answer_lines(self, lines, write):
+        """
+            Fetches every request line concurrently and calls
+            write(bytes) with each response line as it completes.
+        """
+        async def answer(number, text):
+            response = await self.fetch_json(text)
+            await write(json.dumps({"line": number, **response}).encode() + b'\n')
+
+        tasks = list()
+        number = 0
+        async for line in lines:
+            number += 1
+            if line.strip():
+                tasks.append(asyncio.ensure_future(answer(number, line)))
+        await asyncio.gather(*tasks)
+
+    async def serve_socket(self, reader, writer):
+        lock = asyncio.Lock()
+
+        async def lines():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield line
+
+        async def write(data):
+            async with lock:
+                writer.write(data)
+                await writer.drain()
+
+        try:
+            await self.answer_lines(lines(), write)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _http_request(reader):
+        """(method, path, headers, body) of the next request, None once the client closed."""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return method, path, headers, body
+
+    @staticmethod
+    def _http_head(status, headers):
+        lines = [f'HTTP/1.1 {status}'] + [f'{key}: {value}' for key, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def serve_http(self, reader, writer):
+        try:
+            while True:
+                request = await self._http_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                if method != 'POST':
+                    writer.write(self._http_head('405 Method Not Allowed', {'Allow': 'POST', 'Content-Length': 0}))
+                elif LocalServer.NDJSON in headers.get('content-type', ''):
+                    writer.write(self._http_head('200 OK', {'Content-Type': LocalServer.NDJSON,
+                                                            'Transfer-Encoding': 'chunked'}))
+
+                    async def lines():
+                        for line in body.splitlines():
+                            yield line
+
+                    async def write(data):
+                        writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                        await writer.drain()
+
+                    await self.answer_lines(lines(), write)
+                    writer.write(b'0\r\n\r\n')
+                else:
+                    try:
+                        content = json.loads(body)
+                    except ValueError:
+                        content = None
+                    if isinstance(content, dict):
+                        response = await self.fetch(content)
+                    else:
+                        METRICS.count('errors', type='json_format')
+                        response = json.dumps(LocalServer.FORMAT_ERROR).encode()
+                    content_type = 'application/json' if response.startswith(b'{') else 'application/octet-stream'
+                    writer.write(self._http_head('200 OK', {'Content-Type': content_type,
+                                                            'Content-Length': len(response)}) + response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, unix_path=None, http_port=None, host='127.0.0.1'):
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            self._servers.append(await asyncio.start_unix_server(self.serve_socket, path=unix_path))
+            LOGGER.info(f' serving requests on {unix_path}.')
+        if http_port is not None:
+            server = await asyncio.start_server(self.serve_http, host=host, port=http_port)
+            self.http_port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+            LOGGER.info(f' serving requests on http://{host}:{self.http_port}/.')
+        self._started.set()
+        await asyncio.gather(*(server.serve_forever() for server in self._servers))
+
+    def start(self, unix_path=None, http_port=None, host='127.0.0.1'):
+        """Runs the server on its own event loop in a daemon thread, next to the directory mode."""
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            try:
+                self.loop.run_until_complete(self.serve(unix_path, http_port, host))
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                LOGGER.error(f' local server stopped: {e!r}')
+            finally:
+                self._started.set()
+
+        threading.Thread(target=run, name='local_server', daemon=True).start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            self.loop.call_soon_threadsafe(server.close)
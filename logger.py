@@ -1,20 +1,173 @@
-"""Logger declaration and parametrization"""
+"""
+    Logger declaration and parametrization
+
+    Records are put on a queue by the calling thread and formatted and
+    written by a writer thread (QueueListener), so request threads never
+    wait on the file. The log file rotates when it reaches max_bytes or
+    every `when` (e.g. 'midnight', 'W6'), keeping backup_count files.
+
+    json_lines -- one JSON object per record instead of text, with the
+                  request, ticker, kind and stages (seconds per stage)
+                  given as extra={...} by the caller
+    sampling -- {level: n} keeps one record in n of that level, e.g.
+                {logging.INFO: 10} under load; kept records carry "sampled": n
+
+    Pass arguments rather than an f-string (LOGGER.info(' %s', name)) so
+    that dropped and sampled out records are never formatted.
+"""
+import atexit
+import datetime as dt
+import itertools
+import json
 import os
+import queue
 import sys
+import time
 import logging
 from logging import DEBUG, getLogger, StreamHandler, Formatter
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 
+# what `from logger import *` has always given the other modules
+__all__ = ['LOGGER', 'LOG_FILE', 'os', 'sys', 'logging', 'DEBUG', 'getLogger', 'StreamHandler', 'Formatter',
+           'TimedRotatingFileHandler']
 
 LOGGER = getLogger(__name__)
 LOGGER.setLevel(DEBUG)
 LOG_FILE = "log.txt"
+LOG_FORMAT = '[%(levelname)s] %(asctime)s %(message)s'
+LOG_DATEFMT = '%m/%d/%Y %I:%M:%S %p'
+LOG_FIELDS = ('request', 'ticker', 'kind', 'stages', 'sampled')
+
+
+class RotatingHandler(RotatingFileHandler):
+    """RotatingFileHandler also rolling over every `when` ('S', 'M', 'H', 'D', 'midnight' or 'W0'-'W6')."""
+    INTERVALS = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'MIDNIGHT': 86400, 'W': 7 * 86400}
+
+    def __init__(self, filename, max_bytes=0, when=None, backup_count=0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.when = when.upper() if when else None
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now):
+        if self.when is None:
+            return None
+        if self.when[0] != 'W' and self.when != 'MIDNIGHT':
+            return now + RotatingHandler.INTERVALS[self.when]
+        today = dt.datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        days = 1 if self.when == 'MIDNIGHT' else (int(self.when[1]) - today.weekday() - 1) % 7 + 1
+        return (today + dt.timedelta(days=days)).timestamp()
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and record.created >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        if self.rollover_at is not None:
+            self.rollover_at = self._next_rollover(time.time())
+
+
+class JsonFormatter(Formatter):
+    """One JSON object per record: time, level, message and the LOG_FIELDS given as extra."""
+    def format(self, record):
+        entry = {'time': dt.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'message': record.getMessage().strip(),
+                 'thread': record.threadName}
+        for key in LOG_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one record in n per level, n given by {level: n}; other levels are all kept."""
+    def __init__(self, sampling):
+        super().__init__()
+        self.sampling = {level: n for level, n in (sampling or {}).items() if n > 1}
+        self._counters = {level: itertools.count() for level in self.sampling}
 
-logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG, format='[%(levelname)s] %(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    def filter(self, record):
+        n = self.sampling.get(record.levelno)
+        if n is None:
+            return True
+        if next(self._counters[record.levelno]) % n:
+            return False
+        record.sampled = n
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+        Queues the record as is: the message is formatted by the writer
+        thread. Exception tracebacks are rendered now, as their frames
+        do not outlive the caller.
+    """
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_handler = None
+_listener = None
+_settings = None
+
+
+def configure(path=LOG_FILE, json_lines=False, max_bytes=50 * 1024 ** 2, when='midnight', backup_count=10,
+              sampling=None, level=DEBUG):
+    """(Re)configures the root logger: asynchronous, rotating, optionally JSON lines and sampled."""
+    global _handler, _listener, _settings
+    shutdown()
+    _settings = dict(path=path, json_lines=json_lines, max_bytes=max_bytes, when=when,
+                     backup_count=backup_count, sampling=sampling, level=level)
+    writer = RotatingHandler(path, max_bytes=max_bytes, when=when, backup_count=backup_count)
+    writer.setFormatter(JsonFormatter() if json_lines else Formatter(LOG_FORMAT, LOG_DATEFMT))
+    records = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(records)
+    _handler.addFilter(SamplingFilter(sampling))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+    _listener = QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    """Writes out the queued records and stops the writer thread."""
+    global _handler, _listener
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _after_fork():
+    """The writer thread is not inherited by a forked process: start a new one."""
+    global _listener, _handler
+    if _settings is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = _listener = None
+        configure(**_settings)
+
+
+configure()
+atexit.register(shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 # handler = StreamHandler(sys.stdout)
 # handler.setFormatter(Formatter(fmt='%(asctime)s %(levelname)-8s %(message)s',
 #                                datefmt='%m/%d/%Y %I:%M:%S %p'))
 # LOGGER.addHandler(handler)
-# handler = TimedRotatingFileHandler(LOG_FILE, when='W6')
-# LOGGER.addHandler(handler)
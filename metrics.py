@@ -0,0 +1,198 @@
+"""In-process counters, gauges and stage latency histograms in Prometheus text format"""
+import bisect
+import http.server
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from logger import *
+
+
+class Histogram:
+    """Counts of observations per upper bound, plus their sum."""
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {self.sum!r}'
+        yield f'{name}_count{_labels(labels)} {cumulative}'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"'.replace('\n', ' ') for key, value in labels) + '}'
+
+
+class Metrics:
+    """
+        Registry of the server's metrics. Recording is a dict lookup and
+        an increment under one lock, cheap enough to stay on in production.
+
+        with METRICS.stage('json_load'): ...  -- stage latency histogram
+        METRICS.count('errors', type='json_format')  -- counter
+        METRICS.gauge('in_flight', fn)  -- value read from fn when rendered
+
+        Exposed with write(path) / export(path) as a Prometheus text file
+        (node_exporter textfile collector) or serve(port) over HTTP.
+        labels -- label pairs added to every series, e.g. (('worker', '0'),)
+    """
+    PREFIX = 'bploader'
+    HELP = {'stage_seconds': 'Seconds spent per request pipeline stage.',
+            'queue_wait_seconds': 'Seconds requests waited on the scheduler queue.',
+            'requests': 'Request files loaded, by kind.',
+            'socket_requests': 'Requests received by the local server, by kind.',
+            'responses': 'Response files written.',
+            'errors': 'Errors by type.',
+            'cache_lookups': 'Real-time cache lookups by result.',
+            'subscriptions': 'Market data subscriptions started, failed or torn down when idle.',
+            'subscriptions_active': 'Market data subscriptions open.',
+            'janitor_files': 'Responses deleted and debug requests archived by the janitor.',
+            'snapshots': 'In-memory state snapshots saved and restored.',
+            'queue_depth': 'Requests queued on the scheduler.',
+            'class_queue_depth': 'Requests queued on the scheduler, by priority class.',
+            'class_wait_avg_seconds': 'Mean seconds requests waited on the scheduler queue, by priority class.',
+            'class_wait_max_seconds': 'Longest wait on the scheduler queue in seconds, by priority class.',
+            'in_flight': 'Requests queued or running on the scheduler.',
+            'requests_in_memory': 'Requests kept in memory by the factory.'}
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.labels = tuple()
+        self._lock = threading.Lock()
+        self._histograms = dict()
+        self._counters = dict()
+        self._gauges = dict()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(self, stage, timings=None):
+        """Observes the seconds spent in the block, also set as timings[stage] if a dict is given."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('stage_seconds', elapsed, stage=stage)
+            if timings is not None:
+                timings[stage] = round(elapsed, 6)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, fn, **labels):
+        self._gauges[(name, tuple(sorted(labels.items())))] = fn
+
+    def stages(self):
+        """{stage: (count, total seconds)}"""
+        with self._lock:
+            return {dict(labels)['stage']: (sum(h.counts), h.sum)
+                    for (name, labels), h in self._histograms.items() if name == 'stage_seconds'}
+
+    def reset(self):
+        """Drops recorded histograms and counters, gauges stay registered."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def _family(self, base, kind):
+        name = f'{self.prefix}_{base}' + ('_total' if kind == 'counter' else '')
+        return name, [f'# HELP {name} {Metrics.HELP.get(base, base)}', f'# TYPE {name} {kind}']
+
+    def render(self):
+        lines = list()
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        families = dict()
+        for key in histograms:
+            families.setdefault((key[0], 'histogram'), list()).append(key)
+        for key in counters:
+            families.setdefault((key[0], 'counter'), list()).append(key)
+        for key in list(self._gauges):
+            families.setdefault((key[0], 'gauge'), list()).append(key)
+
+        for (base, kind), keys in sorted(families.items()):
+            name, header = self._family(base, kind)
+            lines += header
+            for key in sorted(keys):
+                labels = self.labels + key[1]
+                if kind == 'histogram':
+                    histogram = Histogram(histograms[key][0])
+                    histogram.counts, histogram.sum = histograms[key][1], histograms[key][2]
+                    lines += histogram.lines(name, labels)
+                elif kind == 'counter':
+                    lines.append(f'{name}{_labels(labels)} {counters[key]}')
+                else:
+                    try:
+                        lines.append(f'{name}{_labels(labels)} {float(self._gauges[key]())!r}')
+                    except Exception as e:
+                        LOGGER.warning(f' gauge {name} failed: {e!r}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes the metrics file atomically, as the textfile collector expects."""
+        with open(f'{path}.part', 'w') as outf:
+            outf.write(self.render())
+        os.replace(f'{path}.part', path)
+
+    def export(self, path, interval=15):
+        """Rewrites the metrics file every interval seconds from a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    self.write(path)
+                except OSError as e:
+                    LOGGER.warning(f' unable to write metrics to {path}: {e}')
+                time.sleep(interval)
+        threading.Thread(target=loop, name='metrics_export', daemon=True).start()
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves the metrics on http://host:port/metrics from a daemon thread."""
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics_http', daemon=True).start()
+        LOGGER.info(f' metrics served on http://{host}:{server.server_port}/metrics.')
+        return server
+
+
+METRICS = Metrics()
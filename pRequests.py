@@ -1,13 +1,17 @@
 import time
-import pathlib
+import datetime as dt
 from shutil import copyfile
 import os
 import logging
 import random
+import tempfile
 from enum import Enum
 import concurrent.futures
 from logger import *
 import json
+from errors import SessionPoolError, SubscriptionError
+from metrics import METRICS
+from respWriter import JsonlWriter
 from dataclasses import dataclass, field, asdict
 from abc import ABC, abstractmethod
 
@@ -24,13 +28,96 @@ class Adapter(ABC):
     def create_dump(self, request_json):
         pass
 
+    def create_dumps(self, request_jsons):
+        """
+            Handles a batch of compatible real-time requests.
+            Adapters able to serve them in one call override this.
+        """
+        for request_json in request_jsons:
+            self.create_dump(request_json)
+
 class BloombergAdapter(Adapter):
-    def __init__(self, bloomber_price_loader):
+    """
+        Bloomberg adapter. If a SessionPool is given, every request borrows
+        a long-lived session from it instead of starting its own. If an
+        EventEngine is given instead, all requests share its session and
+        are multiplexed on it. A request whose session dropped is retried
+        on a fresh session.
+        Subscription requests are served by the SubscriptionManager given
+        as subscriptions, if any.
+    """
+    def __init__(self, bloomber_price_loader, pool=None, engine=None, subscriptions=None):
         self.b = bloomber_price_loader
+        self.pool = pool
+        self.engine = engine
+        self.subscriptions = subscriptions
+
+    def _dump(self, build, paths):
+        """
+            Calls build(session) with a borrowed session and dumps the result
+            before handing the session back, as long historical requests
+            are fetched while dumping: a session lost then is retried too.
+            Writes an error response to paths if the pool could not
+            provide a session.
+        """
+        if self.engine is not None:
+            for attempt in range(self.engine.max_retries):
+                loaded = build(self.engine)
+                if not loaded.session_lost:
+                    loaded.get_dump()
+                    if not loaded.session_lost:
+                        return
+                LOGGER.warning(f' session lost for {paths[0]}, retry {attempt + 1}.')
+                METRICS.count('errors', type='session_lost')
+            return loaded.get_dump()
+        if self.pool is None:
+            return build(None).get_dump()
+        try:
+            for attempt in range(self.pool.max_retries):
+                with self.pool.borrow() as session:
+                    loaded = build(session)
+                    if not loaded.session_lost:
+                        loaded.get_dump()
+                        if not loaded.session_lost:
+                            return
+                    LOGGER.warning(f' session lost for {paths[0]}, retry {attempt + 1}.')
+                    METRICS.count('errors', type='session_lost')
+                    self.pool.discard(session)
+            loaded.get_dump()
+        except SessionPoolError as e:
+            LOGGER.warning(f' {", ".join(paths)} not served: {e.message}')
+            METRICS.count('errors', len(paths), type='no_session')
+            for path in paths:
+                with open(path, "w") as outf:
+                    json.dump({"error": e.message}, outf)
+
+    def subscribe(self, request_json):
+        """Writes where to read the ring buffer of the subscription, always in JSON."""
+        try:
+            ticker = request_json['bloomberg_code']
+            fields = request_json.get('attributes', self.subscriptions.FIELDS).split()
+        except (KeyError, AttributeError):
+            ticker, data = 'ERROR', "JSON format error."
+        else:
+            try:
+                data = self.subscriptions.describe(ticker, fields)
+            except SubscriptionError as e:
+                METRICS.count('errors', type='subscription')
+                data = e.message
+        with METRICS.stage('write'), open(request_json['path'], "w") as outf:
+            json.dump({"security": ticker,
+                       "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+                       "data": data}, outf)
 
     def create_dump(self, request_json):
-        self.b1 = self.b.from_dict(**request_json)
-        self.b1.get_dump()
+        if request_json.get('kind') == 'subscription' and self.subscriptions is not None:
+            return self.subscribe(request_json)
+        self._dump(lambda session: self.b.from_dict(**{**request_json, 'session': session}),
+                   [request_json['path']])
+
+    def create_dumps(self, request_jsons):
+        self._dump(lambda session: self.b.from_dicts(request_jsons, session=session),
+                   [r['path'] for r in request_jsons])
 
 class TestAdapter(Adapter):
     def create_dump(self, request_json):
@@ -83,56 +170,195 @@ class Request:
     """
         DataClass for request object.
         Object is initilaized as request json appeares
+
+        Requests order by sort_index: a higher "priority" in the request
+        json first, then subscription, real-time and historical ones, then by mtime.
     """
-    mtime: float
-    content: dict = field(repr=False)
-    alive: bool = True
-    error: bool = False
-    sort_index: int = field(init=False, repr=False)
+    mtime: float = field(compare=False)
+    content: dict = field(repr=False, compare=False)
+    alive: bool = field(default=True, compare=False)
+    error: bool = field(default=False, compare=False)
+    sort_index: tuple = field(init=False, repr=False)
+
+    KINDS = ('subscription', 'real-time', 'historical')
+    MARKER = '.done'
+    IN_PROGRESS = ('.part', '.tmp')
 
     # content : dict = field(default_factory=dict, init=False, repr=False)
     # print(asdict(a))
 
     def __post_init__(self):
-        object.__setattr__(self, 'sort_index', self.mtime)
+        object.__setattr__(self, 'sort_index', (-self.priority, Request.KINDS.index(self.kind)
+                                                if self.kind in Request.KINDS else len(Request.KINDS), self.mtime))
+
+    @property
+    def kind(self):
+        return self.content.get('kind', 'other') if isinstance(self.content, dict) else 'other'
+
+    @property
+    def ticker(self):
+        return self.content.get('bloomberg_code') if isinstance(self.content, dict) else None
+
+    @property
+    def priority(self):
+        try:
+            return int(self.content.get('priority', 0))
+        except (AttributeError, TypeError, ValueError):
+            return 0
 
     def error_occured(self):
         object.__setattr__(self, 'error', True)
         object.__setattr__(self, 'content', '')
 
+    @staticmethod
+    def is_marked(REQ_SOURCE, file_name):
+        """Whether the client marked the file complete with a <file_name>.done file."""
+        return os.path.exists(os.path.join(REQ_SOURCE, file_name + Request.MARKER))
+
+    @staticmethod
+    def claim(REQ_SOURCE, REQ_DEBUG_SOURCE, file_name):
+        """
+            Moves a loaded request file to the debug directory with one rename,
+            which only one server instance can win. Returns False if the
+            file was claimed by another one first. Falls back to copy and
+            delete if the directories are on different file systems.
+        """
+        source = os.path.join(REQ_SOURCE, file_name)
+        with METRICS.stage('claim'):
+            try:
+                os.replace(source, os.path.join(REQ_DEBUG_SOURCE, file_name))
+            except FileNotFoundError:
+                return False
+            except OSError:
+                try:
+                    copyfile(source, os.path.join(REQ_DEBUG_SOURCE, file_name))
+                    os.remove(source)
+                except FileNotFoundError:
+                    return False
+                except OSError:
+                    LOGGER.warning(f' unable to delete {file_name}.')
+                    METRICS.count('errors', type='claim')
+            try:
+                os.remove(source + Request.MARKER)
+            except OSError:
+                pass
+        return True
+
     @classmethod
     def fromFile(cls, REQ_SOURCE, REQ_DEBUG_SOURCE, file_name, retry=False):
-        mtime = pathlib.Path(os.path.join(REQ_SOURCE, file_name)).stat().st_mtime
+        """
+            Loads a request file, then claims it (see claim).
+            Returns None if another instance claimed it first.
+
+            Raises RequestNotReady if the file is not valid JSON, as it may
+            still be being written, unless it is marked complete or this
+            is the retry: it is then a bad request.
+        """
+        path = os.path.join(REQ_SOURCE, file_name)
         error = False
+        stages = dict()
         try:
-            with open(os.path.join(REQ_SOURCE, file_name), 'r') as j:
+            mtime = os.stat(path).st_mtime
+            with METRICS.stage('json_load', stages), open(path, 'r') as j:
                 content = json.load(j)
-                try:
-                    LOGGER.info(f' request {file_name} opened for ticker: {content["bloomberg_code"]}.')
-                except KeyError:
-                    LOGGER.warning(f' request {file_name} opened for ticker. No content loaded.')
+            ticker = content.get('bloomberg_code') if isinstance(content, dict) else None
+            if ticker is not None:
+                LOGGER.info(' request %s opened for ticker: %s.', file_name, ticker,
+                            extra={'request': file_name, 'ticker': ticker, 'kind': content.get('kind'),
+                                   'stages': stages})
+            else:
+                LOGGER.warning(' request %s opened for ticker. No content loaded.', file_name,
+                               extra={'request': file_name, 'stages': stages})
 
         except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            if retry:
-                LOGGER.info(f' JSONDecodeError or UnicodeDecodeError @ {file_name} w {e}.')
-                error = True
-                content = {}
-            else:
-                time.sleep(0.5)
-                return cls.fromFile(REQ_SOURCE, REQ_DEBUG_SOURCE, file_name, retry=True)
+            if not retry and not cls.is_marked(REQ_SOURCE, file_name):
+                raise RequestNotReady
+            LOGGER.info(' JSONDecodeError or UnicodeDecodeError @ %s w %s.', file_name, e, extra={'request': file_name})
+            METRICS.count('errors', type='json_format')
+            error = True
+            content = {}
+
+        except FileNotFoundError:
+            LOGGER.info(' request %s claimed elsewhere.', file_name, extra={'request': file_name})
+            return None
 
         except OSError:
-            LOGGER.warning(f' request {file_name} went missing.')
+            LOGGER.warning(' request %s could not be read.', file_name, extra={'request': file_name})
+            METRICS.count('errors', type='unreadable')
+            mtime = time.time()
             error = True
             content = {}
 
+        if not cls.claim(REQ_SOURCE, REQ_DEBUG_SOURCE, file_name):
+            return None
+        return cls(mtime=mtime, error=error, content=content)
+
+    @classmethod
+    def fromBatchFile(cls, REQ_SOURCE, REQ_DEBUG_SOURCE, file_name, retry=False):
+        """
+            Requests of a .jsonl batch file, one per non-empty line,
+            as {"<file_name>#<line number>": Request}. A line that is not
+            a JSON object is a bad request of its own. Lines are always
+            answered in JSON, whatever their "format".
+
+            Claimed and retried like fromFile: returns None if claimed
+            elsewhere, raises RequestNotReady while a line does not parse.
+        """
+        path = os.path.join(REQ_SOURCE, file_name)
+        stages = dict()
         try:
-            copyfile(os.path.join(REQ_SOURCE, file_name), os.path.join(REQ_DEBUG_SOURCE, file_name))
-            os.remove(os.path.join(REQ_SOURCE, file_name))
+            mtime = os.stat(path).st_mtime
+            with METRICS.stage('json_load', stages), open(path, 'r') as j:
+                lines = j.read().splitlines()
+        except UnicodeDecodeError as e:
+            if not retry and not cls.is_marked(REQ_SOURCE, file_name):
+                raise RequestNotReady
+            LOGGER.info(' UnicodeDecodeError @ %s w %s.', file_name, e, extra={'request': file_name})
+            METRICS.count('errors', type='json_format')
+            lines = []
         except OSError:
-            LOGGER.warning(f' unable to delete {file_name}.')
+            LOGGER.info(' request %s claimed elsewhere.', file_name, extra={'request': file_name})
+            return None
+
+        requests = dict()
+        complete = retry or None
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                content = json.loads(line)
+                if not isinstance(content, dict):
+                    raise ValueError('not a JSON object')
+                content.pop('format', None)
+                requests[f'{file_name}#{number}'] = cls(mtime=mtime, content=content)
+            except ValueError as e:
+                if complete is None:
+                    complete = cls.is_marked(REQ_SOURCE, file_name)
+                if not complete:
+                    raise RequestNotReady
+                LOGGER.info(' bad line %s @ %s w %s.', number, file_name, e, extra={'request': f'{file_name}#{number}'})
+                METRICS.count('errors', type='json_format')
+                requests[f'{file_name}#{number}'] = cls(mtime=mtime, error=True, content={})
+        LOGGER.info(' batch %s opened with %s requests.', file_name, len(requests),
+                    extra={'request': file_name, 'stages': stages})
+
+        if not cls.claim(REQ_SOURCE, REQ_DEBUG_SOURCE, file_name):
+            return None
+        return requests
+
+
+class RequestNotReady(Exception):
+    """
+    Exception raised when a request file does not parse yet
+    and may still be being written. It is loaded again later.
 
-        return cls(mtime=mtime, error=error, content=content)
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Request file is not complete yet."):
+        self.message = message
+        super().__init__(self.message)
 
 
 class DuplicatedEntryError(Exception):
@@ -151,14 +377,53 @@ class DuplicatedEntryError(Exception):
 
 
 class RequestFactory:
+    """
+        Loads request files and hands them to the adapter.
+
+        A .jsonl request file holds one request per line. Each line is
+        handled as a request of its own, tagged "<file name>#<line number>",
+        and answered by a line of the .jsonl response of the same name
+        (see JsonlWriter) as soon as it completes.
+
+        Files are loaded in place and claimed by renaming them to the debug
+        directory. A file that does not parse is left in place and loaded
+        again RETRY_SECS later, without holding up the others. Clients
+        may write to a name ending in .part or .tmp and rename it, or
+        create an empty <file name>.done once the file is written; with
+        require_marker only marked files are loaded.
+
+        Processes sharing the directory pass a LeaseDirectory as leases:
+        a file is only loaded by the process holding its lease. Each step
+        then loads no more files than leave max_pending requests in
+        flight, so the others are left to idle processes.
+    """
     DELETE_AFTER_SECS = 20
+    MAX_BATCH = 50
+    BATCH_SUFFIX = '.jsonl'
+    RETRY_SECS = 0.5
+    # a step that left request files for lack of budget looks again this soon
+    BUDGET_RETRY_SECS = 0.05
+    MAX_PENDING = 100
     def __init__(self,
                  REQ_SOURCE: str,
                  RESP_SOURCE : str,
                  REQ_DEBUG_SOURCE: str,
                  frequency_updater: frequencyUpdater,
-                 adapter : Adapter):
+                 adapter : Adapter,
+                 max_batch : int = MAX_BATCH,
+                 scheduler = None,
+                 require_marker : bool = False,
+                 leases = None,
+                 max_pending : int = MAX_PENDING):
         self.f = frequency_updater
+        self.max_batch = max_batch
+        self.scheduler = scheduler
+        self.require_marker = require_marker
+        self.leases = leases
+        self.max_pending = max_pending
+        self.retries = dict()
+        self.skipped = set()
+        self.budget_full = False
         self.REQ_SOURCE = REQ_SOURCE
         self.REQ_DEBUG_SOURCE = REQ_DEBUG_SOURCE
         self.RESP_SOURCE = RESP_SOURCE
@@ -166,28 +431,170 @@ class RequestFactory:
         self.logging = logging
         self.requests_in_memory = dict()
         self.requests_from_directory = list()
+        self.streams = dict()
+        self._parts = None
 
         self.number_of_requests_before = 0
         self.number_of_requests_after = 0
 
-    def get_requests_from_directory(self):
+    def get_requests_from_directory(self, names=None):
         """
             Check Requests directory. Load items to memory.
+            If a watcher reported names only those are checked.
         """
         self.number_of_requests_before = 0
         self.number_of_requests_before += len(self.requests_in_memory)
 
-        for req_file_name in os.listdir(self.REQ_SOURCE):
-            if req_file_name not in self.requests_in_memory.keys():
-                self.f.speed()  # if requests dir modified speed up iteration
-                self.requests_from_directory.append(
-                    {req_file_name: Request.fromFile(self.REQ_SOURCE, self.REQ_DEBUG_SOURCE,req_file_name)}
-                )
+        now = time.time()
+        with METRICS.stage('discovery'):
+            if names is None:
+                names = os.listdir(self.REQ_SOURCE)
+            names = list(dict.fromkeys(
+                [n[:-len(Request.MARKER)] if n.endswith(Request.MARKER) else n
+                 for n in names if not n.endswith(Request.IN_PROGRESS)] +
+                [n for n, at in self.retries.items() if at <= now] +
+                list(self.skipped)))
+
+        budget = self.max_pending - (self.scheduler.in_flight if self.scheduler is not None else 0)
+        self.budget_full = False
+        for i, req_file_name in enumerate(names):
+            if self.leases is not None and len(self.requests_from_directory) >= budget:
+                # left to idle processes, or to this one on a later step
+                self.skipped.update(names[i:])
+                self.budget_full = True
+                break
+            retry = req_file_name in self.retries
+            if retry and self.retries[req_file_name] > now:
+                continue
+            is_batch = req_file_name.endswith(RequestFactory.BATCH_SUFFIX)
+            if req_file_name in (self.streams if is_batch else self.requests_in_memory):
+                # a reused name waits for the old entry to be discarded,
+                # a watcher will not report the file again
+                if os.path.exists(os.path.join(self.REQ_SOURCE, req_file_name)):
+                    self.skipped.add(req_file_name)
+                continue
+            self.skipped.discard(req_file_name)
+            if self.require_marker and not Request.is_marked(self.REQ_SOURCE, req_file_name):
+                continue
+            if self.leases is not None and not self.leases.acquire(req_file_name):
+                continue
+
+            self.f.speed()  # if requests dir modified speed up iteration
+            try:
+                if is_batch:
+                    self.load_batch(req_file_name, retry)
+                else:
+                    request = Request.fromFile(self.REQ_SOURCE, self.REQ_DEBUG_SOURCE, req_file_name, retry)
+                    if request is not None:
+                        METRICS.count('requests', kind=request.kind)
+                        self.requests_from_directory.append({req_file_name: request})
+            except RequestNotReady:
+                # the lease is kept until the file is loaded
+                self.retries[req_file_name] = now + RequestFactory.RETRY_SECS
+                continue
+            self.retries.pop(req_file_name, None)
+            if self.leases is not None:
+                self.leases.release(req_file_name)
         self.number_of_requests_before += len(self.requests_from_directory)
 
+    def retry_in(self):
+        """
+            Seconds until the next deferred load is due, or until files left
+            for lack of budget are looked at again. None if there is none.
+        """
+        due = [min(self.retries.values()) - time.time()] if self.retries else []
+        if self.budget_full:
+            due.append(RequestFactory.BUDGET_RETRY_SECS)
+        return max(0.0, min(due)) if due else None
+
+    def load_batch(self, file_name, retry=False):
+        """Loads the lines of a .jsonl file as requests and opens its response."""
+        requests = Request.fromBatchFile(self.REQ_SOURCE, self.REQ_DEBUG_SOURCE, file_name, retry)
+        if requests is None:
+            return
+        writer = JsonlWriter(os.path.join(self.RESP_SOURCE, file_name), len(requests))
+        if not writer.done:
+            self.streams[file_name] = writer
+        for requestTag, request in requests.items():
+            METRICS.count('requests', kind=request.kind)
+            self.requests_from_directory.append({requestTag: request})
+
+    def response_path(self, requestTag):
+        """
+            Where the adapter writes the response of a request. Lines of a
+            .jsonl file are written to a scratch file and moved into
+            their stream by responded().
+        """
+        file_name, _, line = requestTag.rpartition('#')
+        if file_name not in self.streams:
+            return os.path.join(self.RESP_SOURCE, requestTag)
+        if self._parts is None:
+            self._parts = tempfile.mkdtemp(prefix='bploader_parts_')
+        return os.path.join(self._parts, f'{file_name}.{line}')
+
+    def responded(self, requestTags):
+        """Appends the responses of .jsonl lines to their stream."""
+        for requestTag in requestTags:
+            file_name, _, line = requestTag.rpartition('#')
+            writer = self.streams.get(file_name)
+            if writer is None:
+                continue
+            part = self.response_path(requestTag)
+            try:
+                with open(part, 'r') as inf:
+                    response = json.load(inf)
+                os.remove(part)
+            except (OSError, ValueError) as e:
+                LOGGER.warning(' no response for %s: %r', requestTag, e, extra={'request': requestTag})
+                response = {"error": "No response."}
+            if writer.append(int(line), response):
+                LOGGER.info(' batch %s complete.', file_name, extra={'request': file_name})
+                del self.streams[file_name]
+
+    def state(self):
+        """
+            Alive requests and open .jsonl streams, for a Snapshot: request
+            files are claimed once loaded, a restart would lose them.
+        """
+        requests = {requestTag: {'mtime': request.mtime, 'content': request.content, 'error': request.error}
+                    for requestTag, request in list(self.requests_in_memory.items()) if request.alive}
+        streams = {file_name: writer.total for file_name, writer in list(self.streams.items())}
+        return {'requests': requests, 'streams': streams}
+
+    def restore(self, state):
+        """
+            Loads the requests of state() back into memory. Requests answered
+            since the state was saved (response file present, .jsonl line
+            already written) are left out. Returns how many were restored.
+        """
+        answered = dict()
+        pending = dict()
+        restored = 0
+        for requestTag, saved in state.get('requests', {}).items():
+            file_name, _, line = requestTag.rpartition('#')
+            if file_name in state.get('streams', {}):
+                if file_name not in answered:
+                    answered[file_name] = JsonlWriter.answered(os.path.join(self.RESP_SOURCE, file_name))
+                if int(line) in answered[file_name]:
+                    continue
+                pending[file_name] = pending.get(file_name, 0) + 1
+            elif os.path.exists(os.path.join(self.RESP_SOURCE, requestTag)):
+                continue
+            if requestTag in self.requests_in_memory:
+                continue
+            self.requests_in_memory[requestTag] = Request(mtime=saved['mtime'], content=saved['content'],
+                                                          error=saved['error'])
+            restored += 1
+        for file_name, count in pending.items():
+            if file_name not in self.streams:
+                total = state['streams'][file_name]
+                self.streams[file_name] = JsonlWriter(os.path.join(self.RESP_SOURCE, file_name), total,
+                                                      written=total - count)
+        return restored
+
     def mergeDict(self):
         """
-            Merging requests from directory to requests in memory
+            Merging requests from directory to requests in memory, in place
 
             Attributes:
                 init_dict -- in memory dict (should be referenced)
@@ -195,30 +602,105 @@ class RequestFactory:
 
         """
         for d in self.requests_from_directory:
-            self.requests_in_memory = {**self.requests_in_memory, **d}
+            self.requests_in_memory.update(d)
 
         self.requests_from_directory = list()
         self.number_of_requests_after = len(self.requests_in_memory)
 
+    def batches(self):
+        """
+            Groups alive real-time requests asking for the same fields
+            into batches of at most max_batch requests.
+            Every other request is a batch of its own.
+            Requests in flight on the scheduler are left out.
+        """
+        groups = dict()
+        singles = list()
+        for requestTag, request in list(self.requests_in_memory.items()):
+            if self.scheduler is not None and self.scheduler.is_running(requestTag):
+                continue
+            if request.alive and not request.error and isinstance(request.content, dict) \
+                    and request.content.get('kind') == 'real-time' and 'bloomberg_code' in request.content:
+                key = frozenset(request.content.get('attributes', '').split())
+                groups.setdefault(key, list()).append(requestTag)
+            else:
+                singles.append([requestTag])
+
+        batched = list()
+        for requestTags in groups.values():
+            batched += [requestTags[i:i + self.max_batch] for i in range(0, len(requestTags), self.max_batch)]
+        return batched + singles
+
     def handle_many_sync(self):
         """
-            Calls handle_one for all requests
+            Calls handle_batch for all batches
             in a sync fashion.
         """
-        for requestObject in list(self.requests_in_memory.keys()):
-            self.handle_one(requestObject)
+        for requestTags in self.batches():
+            self.handle_batch(requestTags)
 
     def handle_many_async(self):
         """
-            Calls handle_one for all requests in threads.
+            Calls handle_batch for all batches in threads.
         """
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            requestObjects = list(self.requests_in_memory.keys())
-            results = [executor.submit(self.handle_one, r) for r in requestObjects]
+            results = [executor.submit(self.handle_batch, r) for r in self.batches()]
 
             for f in concurrent.futures.as_completed(results):
                 f.result()
 
+    def handle_many_pipelined(self):
+        """
+            Submits alive requests to the persistent scheduler without
+            waiting for them. Requests already handled are checked for
+            discarding right away.
+        """
+        for requestTags in self.batches():
+            requests = [self.requests_in_memory[requestTag] for requestTag in requestTags]
+            if any(request.alive for request in requests):
+                first = min(requests)
+                self.scheduler.submit(requestTags, self.handle_batch, self.batch_done,
+                                      priority=first.sort_index, kind=first.kind)
+            else:
+                self.handle_one(requestTags[0])
+
+    def batch_done(self, requestTags, e):
+        """
+            Scheduler callback. A failed batch is answered with an error
+            and not dispatched again.
+        """
+        if e is None:
+            return
+        LOGGER.error(f' {", ".join(requestTags)} failed: {e!r}')
+        METRICS.count('errors', len(requestTags), type=type(e).__name__)
+        for requestTag in requestTags:
+            self.requests_in_memory[requestTag].alive = False
+            with open(self.response_path(requestTag), "w") as outf:
+                json.dump({"error": str(e)}, outf)
+        self.responded(requestTags)
+
+    def handle_batch(self, requestTags):
+        """
+            Process a batch of compatible real-time requests with one
+            adapter call. Single request batches go to handle_one.
+        """
+        if len(requestTags) == 1:
+            return self.handle_one(requestTags[0])
+
+        request_jsons = [{**self.requests_in_memory[requestTag].content,
+                          **{'path': self.response_path(requestTag)}}
+                         for requestTag in requestTags]
+
+        stages = dict()
+        with METRICS.stage('adapter', stages):
+            self.adapter.create_dumps(request_jsons)
+        METRICS.count('responses', len(requestTags))
+        self.responded(requestTags)
+        LOGGER.info(' batch of %s requests successfully sent.', len(requestTags),
+                    extra={'request': ' '.join(requestTags), 'kind': 'real-time', 'stages': stages})
+        for requestTag in requestTags:
+            self.requests_in_memory[requestTag].alive = False
+
     def handle_one(self, requestTag):
         """
             Process request from memory by filename.
@@ -226,45 +708,57 @@ class RequestFactory:
 
         """
         if self.requests_in_memory[requestTag].error and self.requests_in_memory[requestTag].alive:
-            LOGGER.info(f' {requestTag} is a bad request.')
+            LOGGER.info(' %s is a bad request.', requestTag, extra={'request': requestTag})
             self.requests_in_memory[requestTag].alive = False
-            with open(os.path.join(self.RESP_SOURCE, requestTag), "w") as outf:
+            with open(self.response_path(requestTag), "w") as outf:
                 json.dump({"error": "JSON format error."}, outf)
+            METRICS.count('responses')
+            self.responded([requestTag])
 
         elif self.requests_in_memory[requestTag].alive and not self.requests_in_memory[requestTag].error:
             request_json = {**self.requests_in_memory[requestTag].content,
-                            **{'path': os.path.join(self.RESP_SOURCE, requestTag)}}
-
-            self.adapter.create_dump(request_json)
-            LOGGER.info(f' request {requestTag} successfully sent.')
+                            **{'path': self.response_path(requestTag)}}
+
+            stages = dict()
+            with METRICS.stage('adapter', stages):
+                self.adapter.create_dump(request_json)
+            METRICS.count('responses')
+            self.responded([requestTag])
+            request = self.requests_in_memory[requestTag]
+            LOGGER.info(' request %s successfully sent.', requestTag,
+                        extra={'request': requestTag, 'ticker': request.ticker, 'kind': request.kind, 'stages': stages})
             self.requests_in_memory[requestTag].alive = False
 
         elif time.time() - self.requests_in_memory[requestTag].mtime > RequestFactory.DELETE_AFTER_SECS:
-            LOGGER.info(f' request {requestTag} discarded.')
+            LOGGER.info(' request %s discarded.', requestTag, extra={'request': requestTag})
             del self.requests_in_memory[requestTag]
 
-    def process(self):
+    def process(self, names=None):
         """
             Load batch from directory then merge it to memory.
         :return:
         """
-        self.get_requests_from_directory()
+        self.get_requests_from_directory(names)
         self.mergeDict()
 
         if self.number_of_requests_before != self.number_of_requests_after:
             raise DuplicatedEntryError
 
-    def step(self):
+    def step(self, names=None):
         """
             Handling all requests.
+            names -- new request files reported by a watcher, None to scan the directory
         :return:
         """
         try:
-            self.process()
+            self.process(names)
         except DuplicatedEntryError:
             LOGGER.warning("Duplicate found in memory. One of them cleared.")
 
-        self.handle_many_async()
+        if self.scheduler is not None:
+            self.handle_many_pipelined()
+        else:
+            self.handle_many_async()
 
 
 
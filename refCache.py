@@ -0,0 +1,155 @@
+"""TTL cache with in-flight deduplication in front of an Adapter"""
+import base64
+import json
+import threading
+import time
+
+from pRequests import Adapter
+from logger import *
+from metrics import METRICS
+
+
+class _Flight:
+    """Fetch in progress for one key, awaited by identical requests."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class CachingAdapter(Adapter):
+    """
+        Memoizes real-time responses of the wrapped adapter.
+
+        A response is kept for the shortest TTL of its fields' classes
+        (prices short, static fields like EQY_SPLIT_DT long). Identical
+        requests arriving while one is being fetched wait for it and all
+        get its response written to their own path.
+        Other kinds of requests go straight to the wrapped adapter.
+    """
+    TTLS = {'price': 2, 'static': 3600}
+    FIELD_CLASSES = {field: 'static' for field in
+                     ("CRNCY", "NAME", "EQY_SPLIT_DT", "EQY_SPLIT_RATIO", "EQY_SPLIT_ADJUSTMENT_FACTOR",
+                      "SPLIT_DATE_REALTIME", "ID_ISIN", "ID_CUSIP", "EXCH_CODE", "SECURITY_TYP")}
+    DEFAULT_CLASS = 'price'
+    MAX_ENTRIES = 100000
+
+    def __init__(self, adapter: Adapter, ttls=None, field_classes=None):
+        self.adapter = adapter
+        self.ttls = {**CachingAdapter.TTLS, **(ttls or {})}
+        self.field_classes = {**CachingAdapter.FIELD_CLASSES, **(field_classes or {})}
+        self._lock = threading.Lock()
+        self._cache = dict()
+        self._flights = dict()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'shared': self.shared, 'entries': len(self._cache)}
+
+    def state(self):
+        """Unexpired entries, for a Snapshot."""
+        now = time.time()
+        with self._lock:
+            return [[ticker, list(attributes), fmt, expires, base64.b64encode(response).decode()]
+                    for (ticker, attributes, fmt), (expires, response) in self._cache.items() if expires > now]
+
+    def restore(self, state):
+        """Loads the entries of state() still unexpired, returns how many."""
+        now = time.time()
+        entries = {(ticker, tuple(attributes), fmt): (expires, base64.b64decode(response))
+                   for ticker, attributes, fmt, expires, response in state if expires > now}
+        with self._lock:
+            self._cache.update(entries)
+        return len(entries)
+
+    @staticmethod
+    def key(request_json):
+        if request_json.get('kind') != 'real-time' or 'bloomberg_code' not in request_json:
+            return None
+        attributes = request_json.get('attributes', "OPEN HIGH LOW PX_LAST VOLUME").split()
+        return request_json['bloomberg_code'], tuple(sorted(attributes)), request_json.get('format', 'json')
+
+    def ttl(self, key):
+        return min(self.ttls[self.field_classes.get(field, CachingAdapter.DEFAULT_CLASS)] for field in key[1])
+
+    @staticmethod
+    def cacheable(response):
+        """Binary responses are never errors, JSON ones are checked."""
+        if not response.startswith(b'{'):
+            return True
+        try:
+            data = json.loads(response)['data']
+        except (ValueError, KeyError, TypeError):
+            return False
+        return isinstance(data, dict) and 'error' not in data
+
+    @staticmethod
+    def _write(path, response):
+        with open(path, "wb") as outf:
+            outf.write(response)
+
+    def _store(self, key, response):
+        now = time.time()
+        with self._lock:
+            if len(self._cache) >= CachingAdapter.MAX_ENTRIES:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+            self._cache[key] = (now + self.ttl(key), response)
+
+    def create_dump(self, request_json):
+        self.create_dumps([request_json])
+
+    def create_dumps(self, request_jsons):
+        hits, leaders, followers, uncached = list(), list(), list(), list()
+        now = time.time()
+        with self._lock:
+            for request_json in request_jsons:
+                key = self.key(request_json)
+                if key is None:
+                    uncached.append(request_json)
+                elif key in self._cache and self._cache[key][0] > now:
+                    self.hits += 1
+                    hits.append((request_json, self._cache[key][1]))
+                elif key in self._flights:
+                    self.shared += 1
+                    followers.append((request_json, self._flights[key]))
+                else:
+                    self.misses += 1
+                    self._flights[key] = _Flight()
+                    leaders.append((request_json, key))
+
+        for result, requests in (('hit', hits), ('shared', followers), ('miss', leaders)):
+            if requests:
+                METRICS.count('cache_lookups', len(requests), cache='real-time', result=result)
+
+        for request_json, response in hits:
+            self._write(request_json['path'], response)
+
+        for request_json in uncached:
+            self.adapter.create_dump(request_json)
+
+        try:
+            if len(leaders) == 1:
+                self.adapter.create_dump(leaders[0][0])
+            elif leaders:
+                self.adapter.create_dumps([request_json for request_json, _ in leaders])
+            for request_json, key in leaders:
+                with open(request_json['path'], "rb") as inf:
+                    response = inf.read()
+                if self.cacheable(response):
+                    self._store(key, response)
+                self._flights[key].response = response
+        finally:
+            with self._lock:
+                flights = [self._flights.pop(key) for _, key in leaders]
+            for flight in flights:
+                flight.done.set()
+
+        for request_json, flight in followers:
+            flight.done.wait()
+            if flight.response is None:
+                LOGGER.warning(f' shared fetch failed, refetching {request_json["path"]}.')
+                self.adapter.create_dump(request_json)
+            else:
+                self._write(request_json['path'], flight.response)
@@ -0,0 +1,74 @@
+"""
+    Consumer side reader of response files.
+
+    read_response(path) returns {"security", "timestamp", "data"} whatever
+    the "format" of the request was. JSON data comes back as lists; npz and
+    Arrow columns are memory-mapped numpy arrays, not copied into memory.
+    Error responses are always JSON.
+
+    Needs numpy, and pyarrow for Arrow responses.
+"""
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+ARROW_MAGIC = b'ARROW1'
+ZIP_MAGIC = b'PK'
+
+
+def _npz_member(path, info):
+    """Memory-map of one stored .npy member of an npz file."""
+    with open(path, 'rb') as inf:
+        inf.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', inf.read(30)[26:30])
+        inf.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(inf)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(inf)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(inf)
+        offset = inf.tell()
+    if dtype.hasobject or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def read_npz(path, mmap=True):
+    arrays = dict()
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+    loaded = None
+    for info in infos:
+        key = info.filename[:-len('.npy')]
+        array = _npz_member(path, info) if mmap and info.compress_type == zipfile.ZIP_STORED else None
+        if array is None:
+            loaded = loaded if loaded is not None else np.load(path)
+            array = loaded[key]
+        arrays[key] = array
+
+    header = {key.strip('_'): str(arrays.pop(key)) for key in list(arrays) if key.startswith('__')}
+    return {**header, 'data': arrays}
+
+
+def read_arrow(path, mmap=True):
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    source = pa.memory_map(path, 'r') if mmap else pa.OSFile(path, 'rb')
+    table = pa.ipc.open_file(source).read_all()
+    header = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+    return {**header, 'data': {name: table.column(name).to_numpy() for name in table.column_names}}
+
+
+def read_response(path, mmap=True):
+    with open(path, 'rb') as inf:
+        magic = inf.read(len(ARROW_MAGIC))
+    if magic.startswith(ARROW_MAGIC):
+        return read_arrow(path, mmap)
+    if magic.startswith(ZIP_MAGIC):
+        return read_npz(path, mmap)
+    with open(path, 'r') as inf:
+        return json.load(inf)
@@ -0,0 +1,263 @@
+"""Writers of response files: streamed JSON and binary columnar formats"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from lazyImport import lazy_import
+
+np = lazy_import('numpy')
+try:
+    pa = lazy_import('pyarrow')
+except ImportError:
+    pa = None
+
+
+class JsonColumnWriter:
+    """
+        Writes a {"security", "timestamp", "data": {column: [values]}}
+        response from consecutive row chunks, keeping only the current
+        chunk in memory. Each column is spooled to a temporary file next
+        to the response; close() joins them into the response file,
+        byte for byte what json.dump writes for the whole dict.
+    """
+    def __init__(self, path, header, columns):
+        self.path = path
+        self.header = header
+        self.columns = columns
+        directory = os.path.dirname(os.path.abspath(path))
+        self._files = {column: tempfile.TemporaryFile('w+', dir=directory) for column in columns}
+        self._empty = {column: True for column in columns}
+
+    def append(self, chunk):
+        """chunk -- {column: list of values}"""
+        for column in self.columns:
+            values = chunk[column]
+            if not values:
+                continue
+            spool = self._files[column]
+            if not self._empty[column]:
+                spool.write(', ')
+            spool.write(', '.join(map(json.dumps, values)))
+            self._empty[column] = False
+
+    def close(self):
+        with open(self.path + '.part', 'w') as outf:
+            outf.write(json.dumps(self.header)[:-1] + ', "data": {')
+            for idx, column in enumerate(self.columns):
+                outf.write(f'{", " if idx else ""}{json.dumps(column)}: [')
+                spool = self._files[column]
+                spool.seek(0)
+                shutil.copyfileobj(spool, outf)
+                outf.write(']')
+            outf.write('}}')
+        os.replace(self.path + '.part', self.path)
+        self.abort()
+
+    def abort(self):
+        for spool in self._files.values():
+            spool.close()
+
+
+def _json_columns(text):
+    """
+        {column: (offset after its '[', offset of its ']')} of the data of
+        a JSON response as json.dump writes it, None if its data is not
+        made of lists (error and real-time responses).
+    """
+    start = text.find('"data": {')
+    if start < 0:
+        return None
+    decoder = json.JSONDecoder()
+    offsets = dict()
+    pos = start + len('"data": {')
+    while text.startswith('"', pos):
+        column, pos = decoder.raw_decode(text, pos)
+        if not text.startswith(': [', pos):
+            return None
+        pos += len(': [')
+        end = text.index(']', pos)
+        offsets[column] = (pos, end)
+        pos = end + 1
+        if text.startswith(', ', pos):
+            pos += 2
+    return offsets
+
+
+def newest_date(path, columns):
+    """
+        First (newest) date of the historical JSON response at path, None
+        if there is none (or an error response) or it has no rows. Raises
+        ValueError if it holds other columns than columns.
+    """
+    try:
+        with open(path, 'r') as inf:
+            text = inf.read()
+    except OSError:
+        return None
+    offsets = _json_columns(text)
+    if offsets is None:
+        return None
+    if set(offsets) != set(columns):
+        raise ValueError(f"{os.path.basename(path)} does not hold the columns {sorted(columns)}.")
+    start, end = offsets['date']
+    return json.JSONDecoder().raw_decode(text, start)[0] if start < end else None
+
+
+def prepend_rows(path, header, chunk):
+    """
+        Adds the rows of chunk, {column: values} newest first as blbrg
+        cleans them, in front of the rows of the historical JSON response
+        at path, and replaces its header. Rows older than its newest date
+        are dropped and a row of that date replaces the stored one, so
+        adding the same rows twice changes nothing. Only the new values
+        are encoded: the stored ones are copied as text, never parsed.
+        Returns the number of rows added.
+    """
+    with open(path, 'r') as inf:
+        text = inf.read()
+    offsets = _json_columns(text)
+    if offsets is None or set(offsets) != set(chunk):
+        raise ValueError(f"{os.path.basename(path)} does not hold the columns {sorted(chunk)}.")
+
+    decoder = json.JSONDecoder()
+    start, end = offsets['date']
+    newest = decoder.raw_decode(text, start)[0] if start < end else None
+    keep = len(chunk['date']) if newest is None else sum(1 for date in chunk['date'] if date >= newest)
+    replace = newest is not None and keep > 0 and chunk['date'][keep - 1] == newest
+
+    data = text.find('"data": {')
+    parts = [json.dumps(header)[:-1] + ', ']
+    cursor = data
+    for column, (start, end) in sorted(offsets.items(), key=lambda item: item[1]):
+        parts.append(text[cursor:start])
+        rest = start
+        if replace:
+            rest = decoder.raw_decode(text, start)[1]
+            rest += 2 if text.startswith(', ', rest) else 0
+        if keep:
+            parts.append(', '.join(map(json.dumps, chunk[column][:keep])) + (', ' if rest < end else ''))
+        cursor = rest
+    parts.append(text[cursor:])
+
+    with open(path + '.part', 'w') as outf:
+        outf.writelines(parts)
+    os.replace(path + '.part', path)
+    return keep - replace
+
+
+class JsonlWriter:
+    """
+        Response of a .jsonl batch request: one JSON line per request,
+        appended and flushed as each request completes, so lines are in
+        completion order and carry the "line" number of their request.
+        The file is closed once all `total` lines are written.
+        written -- lines already in the file, appended to (restored batch)
+    """
+    def __init__(self, path, total, written=0):
+        self.path = path
+        self.total = total
+        self.written = written
+        self._lock = threading.Lock()
+        self._file = open(path, 'a' if written else 'w')
+        if self.done:
+            self._file.close()
+
+    @staticmethod
+    def answered(path):
+        """Line numbers already answered in the response file at path."""
+        lines = set()
+        try:
+            with open(path, 'r') as inf:
+                for text in inf:
+                    try:
+                        lines.add(json.loads(text)['line'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        return lines
+
+    @property
+    def done(self):
+        return self.written >= self.total
+
+    def append(self, line, response):
+        """line -- 1-based line number of the request, response -- its JSON response"""
+        text = json.dumps({"line": line, **response}) + '\n'
+        with self._lock:
+            self._file.write(text)
+            self._file.flush()
+            self.written += 1
+            if self.done:
+                self._file.close()
+        return self.done
+
+
+def _column(values):
+    """
+        Column of values that may hold None (missing fields): NaN in
+        numeric columns, '' in text ones, so no column is of dtype object,
+        which npz could only store pickled.
+    """
+    array = np.asarray(values)
+    if array.dtype != object:
+        return array
+    if all(isinstance(value, (int, float)) for value in values if value is not None):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array(['' if value is None else str(value) for value in values], dtype=str)
+
+
+def columns(data):
+    """
+        Response data as numpy columns: historical lists as they are,
+        real-time scalars as one row. The date column becomes datetime64[D].
+    """
+    arrays = dict()
+    for key, values in data.items():
+        values = values if isinstance(values, list) else [values]
+        arrays[key] = np.array(values, dtype='datetime64[D]') if key == 'date' else _column(values)
+    return arrays
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_npz(path, header, data):
+    """
+        Uncompressed .npz: every member is stored as is, so readers
+        can memory-map the columns (see respReader).
+    """
+    try:
+        with open(path + '.part', 'wb') as outf:
+            np.savez(outf, **{f'__{key}__': np.array(value) for key, value in header.items()}, **columns(data))
+        os.replace(path + '.part', path)
+    except BaseException:
+        _remove(path + '.part')
+        raise
+
+
+def write_arrow(path, header, data):
+    """Arrow IPC file, memory-mappable by pyarrow.memory_map."""
+    if pa is None:
+        raise ImportError("pyarrow is not installed.")
+    from pyarrow import ipc
+    table = pa.table({key: pa.array(value) for key, value in columns(data).items()},
+                     metadata={key: str(value) for key, value in header.items()})
+    try:
+        with pa.OSFile(path + '.part', 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + '.part', path)
+    except BaseException:
+        _remove(path + '.part')
+        raise
+
+
+WRITERS = {'npz': write_npz, 'arrow': write_arrow}
+FORMATS = ('json',) + tuple(WRITERS)
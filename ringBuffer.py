@@ -0,0 +1,169 @@
+"""
+    Memory-mapped ring buffer of one subscription's updates.
+
+    One writer (the server) appends fixed size records; any number of
+    local readers poll the same file through their own memory map, without
+    a server round trip.
+
+    Layout, little-endian:
+        0     8s   magic b'BPRING01'
+        8     u4   version
+        12    u4   capacity, records in the ring
+        16    u4   n_fields
+        20    u4   closed, set once the subscription is torn down
+        24    u8   write_seq, sequence number of the last record written
+        32    f8   heartbeat, unix time of the last read, set by readers
+        40    32s  field names, n_fields slots of NUL padded ASCII
+        HEADER_SIZE  records: seq u8, time f8, values f8[n_fields]
+
+    The record of sequence number s is at slot (s - 1) % capacity. The
+    writer zeroes a record's seq before rewriting it and stores seq last,
+    then write_seq: a reader keeps the records whose seq is still the
+    expected one after copying them, and missed the ones overwritten
+    while it was away. Fields without any update yet are NaN.
+"""
+import os
+import struct
+import time
+
+from lazyImport import lazy_import
+
+np = lazy_import('numpy')
+
+MAGIC = b'BPRING01'
+VERSION = 1
+HEADER_SIZE = 4096
+FIELD_SIZE = 32
+HEADER = struct.Struct('<8sIIIIQd')
+WRITE_SEQ_OFFSET = 24
+HEARTBEAT_OFFSET = 32
+CLOSED_OFFSET = 20
+FIELDS_OFFSET = HEADER.size
+
+
+class RingBufferError(Exception):
+    """
+    Exception raised when a file is not a ring buffer
+    of this version.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message="Not a ring buffer."):
+        self.message = message
+        super().__init__(self.message)
+
+
+def record_dtype(n_fields):
+    return np.dtype([('seq', '<u8'), ('time', '<f8'), ('values', '<f8', (n_fields,))])
+
+
+def layout(fields, capacity):
+    """Description of the file layout, returned to the clients of a subscription."""
+    return {'magic': MAGIC.decode(), 'version': VERSION, 'header_size': HEADER_SIZE,
+            'record_size': record_dtype(len(fields)).itemsize, 'capacity': capacity,
+            'record': ['seq:u8', 'time:f8'] + [f'{field}:f8' for field in fields]}
+
+
+class _Ring:
+    def _map(self, path, mode):
+        header = np.memmap(path, dtype=np.uint8, mode=mode, shape=(HEADER_SIZE,))
+        magic, version, capacity, n_fields, _, _, _ = HEADER.unpack_from(header, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RingBufferError(f"{path} is not a version {VERSION} ring buffer.")
+        self.path = path
+        self.capacity = capacity
+        self.fields = [bytes(header[FIELDS_OFFSET + i * FIELD_SIZE:FIELDS_OFFSET + (i + 1) * FIELD_SIZE])
+                       .rstrip(b'\0').decode() for i in range(n_fields)]
+        self._header = header
+        self._write_seq = header[WRITE_SEQ_OFFSET:WRITE_SEQ_OFFSET + 8].view('<u8')
+        self._heartbeat = header[HEARTBEAT_OFFSET:HEARTBEAT_OFFSET + 8].view('<f8')
+        self._closed = header[CLOSED_OFFSET:CLOSED_OFFSET + 4].view('<u4')
+        self.records = np.memmap(path, dtype=record_dtype(n_fields), mode=mode,
+                                 offset=HEADER_SIZE, shape=(capacity,))
+
+    @property
+    def write_seq(self):
+        return int(self._write_seq[0])
+
+    @property
+    def heartbeat(self):
+        return float(self._heartbeat[0])
+
+    @property
+    def closed(self):
+        return bool(self._closed[0])
+
+    def close(self):
+        del self.records, self._header, self._write_seq, self._heartbeat, self._closed
+
+
+class RingWriter(_Ring):
+    """Creates (or reopens) the ring file of fields and appends records to it."""
+    def __init__(self, path, fields, capacity=4096):
+        fields = list(fields)
+        if FIELDS_OFFSET + len(fields) * FIELD_SIZE > HEADER_SIZE:
+            raise RingBufferError(f"Too many fields for one ring: {len(fields)}.")
+        if not os.path.exists(path):
+            part = f'{path}.{os.getpid()}.part'
+            with open(part, 'wb') as outf:
+                outf.write(HEADER.pack(MAGIC, VERSION, capacity, len(fields), 0, 0, time.time()))
+                for field in fields:
+                    outf.write(field.encode()[:FIELD_SIZE - 1].ljust(FIELD_SIZE, b'\0'))
+                outf.truncate(HEADER_SIZE + capacity * record_dtype(len(fields)).itemsize)
+            os.replace(part, path)
+        self._map(path, 'r+')
+        if self.fields != [field.encode()[:FIELD_SIZE - 1].decode() for field in fields]:
+            raise RingBufferError(f"{path} holds other fields: {self.fields}.")
+        self._closed[0] = 0
+        self._heartbeat[0] = time.time()
+
+    def append(self, timestamp, values):
+        """Writes the next record, values in the order of fields."""
+        seq = self.write_seq + 1
+        record = self.records[(seq - 1) % self.capacity]
+        record['seq'] = 0
+        record['time'] = timestamp
+        record['values'] = values
+        record['seq'] = seq
+        self._write_seq[0] = seq
+        return seq
+
+    def mark_closed(self):
+        self._closed[0] = 1
+        self.records.flush()
+
+
+class RingReader(_Ring):
+    """
+        Polls a ring written by another process.
+
+        reader = RingReader(path)
+        records, since = reader.read(since)  -- records written after since
+    """
+    def __init__(self, path):
+        self._map(path, 'r+')
+
+    def read(self, since=0):
+        """
+            (records, last seq) of the records written after sequence number
+            since, oldest first, as a structured array with seq, time and
+            values columns. Marks the ring as read (heartbeat).
+        """
+        self._heartbeat[0] = time.time()
+        last = self.write_seq
+        first = max(since + 1, last - self.capacity + 1, 1)
+        if first > last:
+            return self.records[:0].copy(), last
+        seqs = np.arange(first, last + 1, dtype=np.uint64)
+        records = self.records[(seqs - 1) % self.capacity].copy()
+        # records rewritten while being copied no longer hold their expected seq
+        return records[records['seq'] == seqs], last
+
+    def latest(self):
+        """{field: value} of the last record, None if nothing was written yet."""
+        records, _ = self.read(max(self.write_seq - 1, 0))
+        if not len(records):
+            return None
+        return dict(zip(self.fields, records['values'][-1].tolist()))
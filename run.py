@@ -2,8 +2,11 @@ from blbrgPrice import blbrg
 import datetime as dt
 import pathlib
 import os
+import signal
+import threading
 import time
 import json
+import logger
 from logger import *
 # from IPython.display import clear_output
 from dataclasses import dataclass, field, asdict
@@ -11,35 +14,151 @@ from shutil import copyfile
 from enum import Enum
 
 import pRequests
+import spoolWatcher
+from scheduler import Scheduler, TokenBucket
+from sessionPool import SessionPool
+from histCache import HistoricalCache
+from refCache import CachingAdapter
+from metrics import METRICS
+from localServer import LocalServer
+from subscriptions import SubscriptionManager
+from janitor import Janitor
+from snapshot import Snapshot
+from supervisor import InstanceLock, LeaseDirectory, Supervisor
 
-import win32event
-import win32api
-from winerror import ERROR_ALREADY_EXISTS
+REQ_SOURCE = pathlib.Path('requests')
+RESP_SOURCE = pathlib.Path('responses')
+REQ_DEBUG_SOURCE = pathlib.Path('requests_debug')
+CACHE_SOURCE = pathlib.Path('cache')
+LEASE_SOURCE = pathlib.Path('leases')
+SUBSCRIPTION_SOURCE = pathlib.Path('subscriptions')
+DATASET_SOURCE = pathlib.Path('datasets')
+ARCHIVE_SOURCE = pathlib.Path('archive')
+LOCK_FILE = pathlib.Path('bploader.lock')
+# in-memory state (pending requests, cached responses, subscriptions) saved on shutdown
+# and every SNAPSHOT_INTERVAL_SECS, restored on start; None to start empty
+SNAPSHOT_FILE = pathlib.Path('state.json')
+SNAPSHOT_INTERVAL_SECS = 30
 
-### SINGLETON
-mutex = win32event.CreateMutex(None, False, 'name')
-last_error = win32api.GetLastError()
+# 1: a single process serves the spool. More: a supervisor runs WORKERS processes
+# sharing it, each with its own sessions, caches in memory and scheduler.
+WORKERS = 1
+POOL_SIZE = 8
+REQUESTS_PER_SEC = 50
+# "kind": "subscription" requests: seconds a subscription nobody requests or reads stays open
+SUBSCRIPTION_IDLE_SECS = 300
 
-if last_error == ERROR_ALREADY_EXISTS:
-    print("Instance already running.")
+# log.txt in JSON lines (request, ticker, kind, stage seconds per record) and/or sampled,
+# e.g. LOG_SAMPLING = {logging.INFO: 10} keeps one info record in 10 under load
+LOG_JSON_LINES = False
+LOG_SAMPLING = None
 
-else:
-    REQ_SOURCE = pathlib.Path('requests')
-    RESP_SOURCE = pathlib.Path('responses')
-    REQ_DEBUG_SOURCE = pathlib.Path('requests_debug')
+# Janitor: uncollected responses kept RESPONSE_MAX_AGE_SECS (at most RESPONSE_MAX_COUNT),
+# debug requests archived after ARCHIVE_AFTER_SECS (python janitor.py --name/--ticker to look them up)
+RESPONSE_MAX_AGE_SECS = 7 * 24 * 3600
+RESPONSE_MAX_COUNT = 100000
+ARCHIVE_AFTER_SECS = 3600
 
-    for folder in REQ_SOURCE, RESP_SOURCE, REQ_DEBUG_SOURCE:
-        if not os.path.isdir(folder):
-            os.mkdir(folder)
+# Optional local front-end next to the directories: a Unix socket path and/or a localhost HTTP port
+SOCKET_PATH = None
+HTTP_PORT = None
+
+# Prometheus text file for the node_exporter textfile collector; set METRICS_PORT to also serve it over HTTP
+METRICS_FILE = pathlib.Path('metrics.prom')
+METRICS_PORT = None
+
+
+def warm_up(pool):
+    try:
+        pool.warm_up()
+    except Exception as e:
+        LOGGER.warning(f' session pool warm up failed: {e!r}')
+
+
+def serve(worker_id=None):
+    """
+        Serves the spool until killed. worker_id is set for
+        the worker processes of a supervisor.
+    """
+    if worker_id is not None:
+        # a log file per worker, as processes cannot share its rotation
+        log_file = pathlib.Path(LOG_FILE)
+        logger.configure(path=str(log_file.with_name(f'{log_file.stem}_{worker_id}{log_file.suffix}')),
+                         json_lines=LOG_JSON_LINES, sampling=LOG_SAMPLING)
+    pool = SessionPool(size=POOL_SIZE)
+    # the spool is served while sessions start, a request opens one itself if none is ready yet
+    threading.Thread(target=warm_up, args=(pool,), name='pool_warm_up', daemon=True).start()
+    blbrg.cache = HistoricalCache(CACHE_SOURCE)
+    blbrg.datasets = DATASET_SOURCE
+    blbrg.limiter = TokenBucket(REQUESTS_PER_SEC / WORKERS)
 
     requests = dict()
+    scheduler = Scheduler(max_workers=POOL_SIZE)
+    # a ring has one writer: each worker its own subscriptions and directory of rings
+    subscriptions = SubscriptionManager(SUBSCRIPTION_SOURCE if worker_id is None else SUBSCRIPTION_SOURCE / str(worker_id),
+                                        idle_secs=SUBSCRIPTION_IDLE_SECS)
+    adapter = CachingAdapter(pRequests.BloombergAdapter(blbrg, pool, subscriptions=subscriptions))
     factory = pRequests.RequestFactory(REQ_SOURCE,
                                        RESP_SOURCE,
 				       REQ_DEBUG_SOURCE,
                                        pRequests.frequencyUpdater(),
-                                       pRequests.BloombergAdapter(blbrg))
-    while True:
-        factory.f.wait()
-        factory.step()
+                                       adapter,
+                                       scheduler=scheduler,
+                                       leases=LeaseDirectory(LEASE_SOURCE) if worker_id is not None else None)
+
+    if (SOCKET_PATH is not None or HTTP_PORT is not None) and not worker_id:
+        LocalServer(adapter, scheduler).start(unix_path=SOCKET_PATH, http_port=HTTP_PORT)
+    if not worker_id:
+        Janitor(RESP_SOURCE, REQ_DEBUG_SOURCE, ARCHIVE_SOURCE, response_max_age=RESPONSE_MAX_AGE_SECS,
+                response_max_count=RESPONSE_MAX_COUNT, archive_after=ARCHIVE_AFTER_SECS).start()
+
+    metrics_file = METRICS_FILE
+    if worker_id is not None:
+        METRICS.labels = (('worker', str(worker_id)),)
+        metrics_file = METRICS_FILE.with_name(f'{METRICS_FILE.stem}_{worker_id}{METRICS_FILE.suffix}')
+    METRICS.gauge('queue_depth', lambda: scheduler.queued)
+    METRICS.gauge('in_flight', lambda: scheduler.in_flight)
+    METRICS.gauge('requests_in_memory', lambda: len(factory.requests_in_memory))
+    METRICS.gauge('subscriptions_active', lambda: subscriptions.active)
+    METRICS.export(metrics_file)
+    if METRICS_PORT is not None:
+        METRICS.serve(METRICS_PORT + (worker_id or 0))
+
+    snapshot = None
+    if SNAPSHOT_FILE is not None:
+        snapshot_file = SNAPSHOT_FILE if worker_id is None else \
+            SNAPSHOT_FILE.with_name(f'{SNAPSHOT_FILE.stem}_{worker_id}{SNAPSHOT_FILE.suffix}')
+        snapshot = Snapshot(snapshot_file, {'requests': factory, 'cache': adapter, 'subscriptions': subscriptions},
+                            interval=SNAPSHOT_INTERVAL_SECS)
+        snapshot.restore()
+        # SIGTERM unwinds through the finally below like Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    watcher = spoolWatcher.create(REQ_SOURCE, factory.f)
+    try:
+        while True:
+            factory.step(watcher.wait(factory.retry_in()))
+            if snapshot is not None:
+                snapshot.tick()
+    finally:
+        if snapshot is not None:
+            snapshot.save()
+            LOGGER.info(f' state saved to {snapshot.path}.')
+
+
+if __name__ == "__main__":
+    logger.configure(json_lines=LOG_JSON_LINES, sampling=LOG_SAMPLING)
+    ### SINGLETON
+    lock = InstanceLock(LOCK_FILE)
+    if not lock.acquire():
+        print("Instance already running.")
 
+    else:
+        for folder in REQ_SOURCE, RESP_SOURCE, REQ_DEBUG_SOURCE, DATASET_SOURCE:
+            if not os.path.isdir(folder):
+                os.mkdir(folder)
 
+        if WORKERS > 1:
+            Supervisor(WORKERS, serve).run()
+        else:
+            serve()
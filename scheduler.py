@@ -0,0 +1,161 @@
+"""Persistent worker pool dispatching requests across factory steps"""
+import itertools
+import queue
+import threading
+import time
+
+from logger import *
+from metrics import METRICS
+
+
+class TokenBucket:
+    """
+        Limits calls to `rate` per second with bursts of up to `burst` calls.
+        acquire() blocks the calling worker until a token is available.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ClassStats:
+    """Queue depth and wait time of one priority class."""
+    def __init__(self):
+        self.queued = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        return {'queued': self.queued,
+                'dispatched': self.dispatched,
+                'avg_wait': self.total_wait / self.dispatched if self.dispatched else 0.0,
+                'max_wait': self.max_wait}
+
+
+class Scheduler:
+    """
+        Long-lived worker threads fed continuously by RequestFactory.step.
+        Unlike handle_many_async, a step does not wait for its requests, so a
+        slow historical pull does not hold back requests of later steps.
+
+        Work is taken by priority (see Request.sort_index): real-time before
+        historical, FIFO by mtime within a class, unless the request sets a
+        "priority". Requests are tracked by file name while in flight, so a
+        request still running is never dispatched twice.
+
+        max_workers -- requests fetched concurrently
+        max_in_flight -- requests running or queued, further ones wait for a later step
+    """
+    MAX_WORKERS = 8
+    MAX_IN_FLIGHT = 1000
+
+    def __init__(self, max_workers=MAX_WORKERS, max_in_flight=MAX_IN_FLIGHT):
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._stats = dict()
+        self._workers = [threading.Thread(target=self._work, name=f'request_{i}', daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def is_running(self, requestTag):
+        return requestTag in self._in_flight
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """{priority class: queue depth and wait times}"""
+        with self._lock:
+            return {kind: s.as_dict() for kind, s in self._stats.items()}
+
+    @staticmethod
+    def _publish(kind, stats):
+        """Exports the stats of a new priority class as gauges, read when the metrics are written."""
+        METRICS.gauge('class_queue_depth', lambda: stats.queued, kind=kind)
+        METRICS.gauge('class_wait_avg_seconds', lambda: stats.as_dict()['avg_wait'], kind=kind)
+        METRICS.gauge('class_wait_max_seconds', lambda: stats.max_wait, kind=kind)
+
+    def submit(self, requestTags, fn, on_done=None, priority=(), kind='other'):
+        """
+            Queues fn(requestTags) unless one of the tags is in flight or
+            the in flight limit is reached. Returns whether it was queued.
+            on_done(requestTags, error or None) is called from the worker.
+            priority -- sort key, lowest first; kind -- class reported in stats
+        """
+        with self._lock:
+            if len(self._in_flight) + len(requestTags) > self.max_in_flight and self._in_flight:
+                return False
+            if any(requestTag in self._in_flight for requestTag in requestTags):
+                return False
+            self._in_flight.update(requestTags)
+            stats = self._stats.get(kind)
+            if stats is None:
+                stats = self._stats[kind] = ClassStats()
+                self._publish(kind, stats)
+            stats.queued += 1
+
+        self._queue.put((priority, next(self._seq), (requestTags, fn, on_done, kind, time.monotonic())))
+        return True
+
+    def _work(self):
+        while True:
+            _, _, item = self._queue.get()
+            if item is None:
+                return
+            requestTags, fn, on_done, kind, queued_at = item
+            waited = time.monotonic() - queued_at
+            with self._lock:
+                stats = self._stats[kind]
+                stats.queued -= 1
+                stats.dispatched += 1
+                stats.total_wait += waited
+                stats.max_wait = max(stats.max_wait, waited)
+            METRICS.observe('queue_wait_seconds', waited, kind=kind)
+
+            error = None
+            try:
+                fn(requestTags)
+            except Exception as e:
+                error = e
+            try:
+                if on_done is not None:
+                    on_done(requestTags, error)
+            except Exception as e:
+                LOGGER.error(f' callback for {", ".join(requestTags)} failed: {e!r}')
+            finally:
+                with self._lock:
+                    self._in_flight.difference_update(requestTags)
+
+    def shutdown(self, wait=True):
+        """Stops the workers once the queued work is done."""
+        for _ in self._workers:
+            self._queue.put(((float('inf'),), next(self._seq), None))
+        if wait:
+            for worker in self._workers:
+                worker.join()
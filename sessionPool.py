@@ -0,0 +1,171 @@
+"""Pool of long-lived blpapi sessions shared by the request worker threads"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from errors import SessionPoolError
+from lazyImport import lazy_import
+from logger import *
+
+blpapi = lazy_import('blpapi')
+
+
+class SessionPool:
+    """
+        Keeps up to `size` started sessions with //blp/refdata opened.
+        Worker threads borrow a session for one request and hand it back,
+        instead of starting and stopping a session per request.
+
+        Idle sessions older than HEALTH_CHECK_SECS are checked before
+        being lent out; broken sessions are stopped and replaced.
+    """
+    SERVICE = "//blp/refdata"
+    HEALTH_CHECK_SECS = 30
+    SESSION_DOWN = ("SessionConnectionDown", "SessionTerminated", "SessionStartupFailure")
+
+    def __init__(self, size=4, host='localhost', port=8194, max_retries=3):
+        self.size = size
+        self.host = host
+        self.port = port
+        self.max_retries = max_retries
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._discarded = set()
+
+    def _connect(self):
+        sessionOptions = blpapi.SessionOptions()
+        sessionOptions.setServerHost(self.host)
+        sessionOptions.setServerPort(self.port)
+        session = blpapi.Session(sessionOptions)
+
+        if not session.start():
+            raise SessionPoolError("Failed to start session.")
+        if not session.openService(SessionPool.SERVICE):
+            session.stop()
+            raise SessionPoolError(f"Failed to open {SessionPool.SERVICE}")
+        self._drain(session)
+        return session
+
+    @staticmethod
+    def _drain(session):
+        """
+            Consumes pending status events of an idle session.
+            Returns False if the session reported it went down.
+        """
+        healthy = True
+        ev = session.tryNextEvent()
+        while ev is not None:
+            if ev.eventType() == blpapi.Event.SESSION_STATUS:
+                healthy &= not any(str(msg.messageType()) in SessionPool.SESSION_DOWN for msg in ev)
+            ev = session.tryNextEvent()
+        return healthy
+
+    def is_healthy(self, session):
+        try:
+            session.getService(SessionPool.SERVICE)
+        except Exception:
+            return False
+        return self._drain(session)
+
+    @staticmethod
+    def _close(session):
+        try:
+            session.stop()
+        except Exception:
+            pass
+
+    def _replace(self):
+        """Refills a freed slot; if the terminal is down the next borrower retries."""
+        try:
+            self._idle.put((self._connect(), time.time()))
+        except (SessionPoolError, blpapi.Exception) as e:
+            LOGGER.warning(f' unable to reconnect pooled session: {e}')
+            with self._lock:
+                self._created -= 1
+            self._idle.put((None, 0))
+
+    def warm_up(self):
+        """Starts all sessions up front so the first requests pay no setup cost."""
+        while True:
+            with self._lock:
+                if self._created >= self.size:
+                    break
+                self._created += 1
+            try:
+                self._idle.put((self._connect(), time.time()))
+            except (SessionPoolError, blpapi.Exception):
+                with self._lock:
+                    self._created -= 1
+                raise
+        LOGGER.info(f' session pool warmed up with {self.size} sessions.')
+
+    def _acquire(self, timeout):
+        while True:
+            try:
+                session, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except (SessionPoolError, blpapi.Exception):
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    session, returned_at = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise SessionPoolError("No pooled session available.")
+
+            if session is None:
+                continue
+            # a session that reported SessionConnectionDown is replaced; any other one
+            # is health-checked again once its event queue is drained, unless it was
+            # handed back less than HEALTH_CHECK_SECS ago
+            if self._drain(session) and (time.time() - returned_at < SessionPool.HEALTH_CHECK_SECS
+                                         or self.is_healthy(session)):
+                return session
+            LOGGER.warning(' pooled session failed health check, reconnecting.')
+            self._close(session)
+            with self._lock:
+                self._created -= 1
+
+    def discard(self, session):
+        """Marks a borrowed session as broken; it is replaced once handed back."""
+        self._discarded.add(session)
+
+    def _release(self, session):
+        if session in self._discarded:
+            self._discarded.discard(session)
+            self._close(session)
+            self._replace()
+        else:
+            self._idle.put((session, time.time()))
+
+    @contextmanager
+    def borrow(self, timeout=None):
+        session = self._acquire(timeout)
+        try:
+            yield session
+        except Exception:
+            self.discard(session)
+            raise
+        finally:
+            self._release(session)
+
+    def close(self):
+        """Stops every idle session."""
+        while True:
+            try:
+                session, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if session is not None:
+                self._close(session)
+        with self._lock:
+            self._created = 0
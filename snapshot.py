@@ -0,0 +1,80 @@
+"""Snapshot of the server's in-memory state, restored on the next start"""
+import json
+import os
+import time
+
+from metrics import METRICS
+from logger import *
+
+
+class Snapshot:
+    """
+        Saves the state() of each of parts, {name: part}, to one JSON file
+        and hands it back to their restore(state) on the next start: the
+        requests loaded but not answered yet, the cached responses still
+        fresh, the subscriptions open.
+
+        save() replaces the file atomically; run it on shutdown, and tick()
+        from the serving loop saves every interval seconds, so a crash
+        loses at most that much. A snapshot older than max_age seconds is
+        ignored on restore.
+    """
+    VERSION = 1
+    INTERVAL_SECS = 30
+    MAX_AGE_SECS = 3600
+
+    def __init__(self, path, parts, interval=INTERVAL_SECS, max_age=MAX_AGE_SECS):
+        self.path = str(path)
+        self.parts = parts
+        self.interval = interval
+        self.max_age = max_age
+        self._next = time.time() + interval
+
+    def save(self):
+        state = {'version': Snapshot.VERSION, 'time': time.time()}
+        for name, part in self.parts.items():
+            try:
+                state[name] = part.state()
+            except Exception as e:
+                LOGGER.error(f' unable to snapshot {name}: {e!r}')
+        with open(self.path + '.part', 'w') as outf:
+            json.dump(state, outf)
+        os.replace(self.path + '.part', self.path)
+        METRICS.count('snapshots', action='saved')
+        self._next = time.time() + self.interval
+
+    def tick(self):
+        """Saves if the last save is interval seconds old."""
+        if time.time() >= self._next:
+            try:
+                self.save()
+            except OSError as e:
+                LOGGER.error(f' unable to save snapshot: {e!r}')
+                self._next = time.time() + self.interval
+
+    def restore(self):
+        """Restores the parts from the snapshot file if there is a recent one, returns {name: restored}."""
+        try:
+            with open(self.path, 'r') as inf:
+                state = json.load(inf)
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f' unreadable snapshot {self.path}: {e!r}')
+            return dict()
+        age = time.time() - state.get('time', 0)
+        if state.get('version') != Snapshot.VERSION or age > self.max_age:
+            LOGGER.info(f' snapshot {self.path} ignored, {age:.0f}s old.')
+            return dict()
+
+        restored = dict()
+        for name, part in self.parts.items():
+            if name not in state:
+                continue
+            try:
+                restored[name] = part.restore(state[name])
+            except Exception as e:
+                LOGGER.error(f' unable to restore {name}: {e!r}')
+        LOGGER.info(f' restored from snapshot: {restored}.')
+        METRICS.count('snapshots', action='restored')
+        return restored
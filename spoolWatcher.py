@@ -0,0 +1,132 @@
+"""Watching the requests directory for new request files"""
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+
+from logger import *
+
+
+class PollingWatcher:
+    """
+        Fallback watcher: sleeps as told by the frequencyUpdater
+        and lets the factory list the whole directory.
+    """
+    def __init__(self, directory, frequency_updater):
+        self.directory = directory
+        self.f = frequency_updater
+
+    def wait(self, timeout=None):
+        """
+            Returns None: every file in the directory has to be checked.
+            Sleeps no longer than timeout if given.
+        """
+        if timeout is None:
+            self.f.wait()
+        else:
+            time.sleep(min(timeout, self.f.sleep))
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+        Linux inotify watcher. Blocks until files are closed after writing
+        or moved into the directory and returns their names, so requests
+        are dispatched as soon as they are complete.
+
+        wait() still returns after `timeout` seconds without events so
+        the factory can discard old requests from memory. Created in the
+        main thread, it also returns on a signal: one received by another
+        thread would not interrupt its select, its handler (e.g. SIGTERM
+        saving a snapshot) would wait for the timeout.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, directory, timeout=10):
+        self.directory = directory
+        self.timeout = timeout
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(directory)),
+                                          InotifyWatcher.IN_CLOSE_WRITE | InotifyWatcher.IN_MOVED_TO)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed on {directory}')
+        # files written before the watch started are found by a full scan
+        self._rescan = True
+        self._signals = self._wakeup = None
+        if threading.current_thread() is threading.main_thread():
+            self._signals, self._wakeup = os.pipe()
+            os.set_blocking(self._signals, False)
+            os.set_blocking(self._wakeup, False)
+            signal.set_wakeup_fd(self._wakeup)
+
+    def _read(self):
+        names = list()
+        while True:
+            try:
+                buffer = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = InotifyWatcher.EVENT.unpack_from(buffer, offset)
+                offset += InotifyWatcher.EVENT.size
+                if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                    self._rescan = True
+                elif length:
+                    names.append(os.fsdecode(buffer[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def wait(self, timeout=None):
+        """
+            Names of new request files, None when the whole
+            directory has to be scanned (start up, event queue overflow).
+            Waits for events no longer than timeout if given.
+        """
+        if not self._rescan:
+            select.select([self._fd] + ([self._signals] if self._signals is not None else []), [], [],
+                          self.timeout if timeout is None else min(timeout, self.timeout))
+            if self._signals is not None:
+                try:
+                    os.read(self._signals, 512)
+                except BlockingIOError:
+                    pass
+        names = self._read()
+        if self._rescan:
+            self._rescan = False
+            LOGGER.info(' scanning whole requests directory.')
+            return None
+        return list(dict.fromkeys(names))
+
+    def close(self):
+        os.close(self._fd)
+        if self._signals is not None:
+            previous = signal.set_wakeup_fd(-1)
+            if previous != self._wakeup:
+                signal.set_wakeup_fd(previous)
+            os.close(self._wakeup)
+            os.close(self._signals)
+
+
+def create(directory, frequency_updater):
+    """inotify watcher on Linux, polling watcher elsewhere or if inotify is unavailable."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            LOGGER.warning(f' inotify unavailable ({e}), polling requests directory.')
+    return PollingWatcher(directory, frequency_updater)
@@ -0,0 +1,256 @@
+"""Live //blp/mktdata subscriptions written to memory-mapped ring buffers"""
+import hashlib
+import os
+import threading
+import time
+
+from errors import SubscriptionError
+from lazyImport import lazy_import
+from ringBuffer import RingWriter, layout
+from metrics import METRICS
+from logger import *
+
+np = lazy_import('numpy')
+blpapi = lazy_import('blpapi')
+
+
+class _Subscription:
+    """One ticker and set of fields subscribed, and its ring."""
+    def __init__(self, ticker, fields, ring):
+        self.ticker = ticker
+        self.fields = fields
+        self.ring = ring
+        self.cid = blpapi.CorrelationId()
+        self.values = np.full(len(fields), np.nan)
+        self.requested = time.time()
+        self.started = threading.Event()
+        self.failure = None
+
+
+class SubscriptionManager:
+    """
+        Opens one //blp/mktdata subscription per ticker and set of fields
+        on a single event-handler session, however many clients ask for it.
+        Every update is appended to the subscription's ring buffer in
+        directory, as a record of all the fields: fields missing from an
+        update keep their last value.
+
+        A subscription neither requested again nor read (ring heartbeat)
+        for idle_secs is unsubscribed and its ring marked closed; the
+        next request for it subscribes again into the same ring.
+    """
+    SERVICE = "//blp/mktdata"
+    SESSION_DOWN = ("SessionConnectionDown", "SessionTerminated", "SessionStartupFailure")
+    IDLE_SECS = 300
+    CAPACITY = 4096
+    START_TIMEOUT_SECS = 30
+    SWEEP_SECS = 5
+    FIELDS = "LAST_PRICE BID ASK"
+
+    def __init__(self, directory, idle_secs=IDLE_SECS, capacity=CAPACITY, host='localhost', port=8194,
+                 session_factory=None):
+        self.directory = directory
+        self.idle_secs = idle_secs
+        self.capacity = capacity
+        self.host = host
+        self.port = port
+        self._session_factory = session_factory or blpapi.Session
+        self._lock = threading.Lock()
+        self._session = None
+        self._subscriptions = dict()
+        self._by_cid = dict()
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def active(self):
+        return len(self._subscriptions)
+
+    def path(self, ticker, fields):
+        """Ring file of ticker and fields, stable across restarts."""
+        key = hashlib.sha1(f'{ticker}|{" ".join(fields)}'.encode()).hexdigest()[:16]
+        name = ''.join(c if c.isalnum() else '_' for c in ticker)
+        return os.path.join(self.directory, f'{name}.{key}.ring')
+
+    def _connect(self):
+        started = threading.Event()
+        state = {'up': False}
+
+        def on_event(event, session):
+            if not started.is_set() and event.eventType() == blpapi.Event.SESSION_STATUS:
+                for msg in event:
+                    if str(msg.messageType()) == "SessionStarted":
+                        state['up'] = True
+                        started.set()
+                    elif str(msg.messageType()) in SubscriptionManager.SESSION_DOWN:
+                        started.set()
+                return
+            self._on_event(event, session)
+
+        sessionOptions = blpapi.SessionOptions()
+        sessionOptions.setServerHost(self.host)
+        sessionOptions.setServerPort(self.port)
+        session = self._session_factory(sessionOptions, on_event)
+        if not session.start() or not started.wait(SubscriptionManager.START_TIMEOUT_SECS) or not state['up']:
+            session.stop()
+            raise SubscriptionError("Failed to start session.")
+        if not session.openService(SubscriptionManager.SERVICE):
+            session.stop()
+            raise SubscriptionError(f"Failed to open {SubscriptionManager.SERVICE}")
+        LOGGER.info(' subscription session started.')
+        return session
+
+    def _subscribe(self, subscription):
+        """Sends the subscription, with self._lock held."""
+        if self._session is None:
+            self._session = self._connect()
+        subscription.cid = blpapi.CorrelationId()
+        subscription.started.clear()
+        subscription.failure = None
+        self._by_cid[subscription.cid] = subscription
+        subscriptions = blpapi.SubscriptionList()
+        subscriptions.add(subscription.ticker, subscription.fields, "", subscription.cid)
+        self._session.subscribe(subscriptions)
+
+    def subscribe(self, ticker, fields):
+        """
+            Path of the ring of ticker and fields, subscribing first unless
+            already subscribed. Raises SubscriptionError if Bloomberg refused
+            the subscription.
+        """
+        fields = sorted(set(fields))
+        key = (ticker, tuple(fields))
+        with self._lock:
+            subscription = self._subscriptions.get(key)
+            if subscription is None:
+                ring = RingWriter(self.path(ticker, fields), fields, self.capacity)
+                subscription = self._subscriptions[key] = _Subscription(ticker, fields, ring)
+                try:
+                    self._subscribe(subscription)
+                except Exception:
+                    del self._subscriptions[key]
+                    ring.close()
+                    raise
+                LOGGER.info(f' subscribed to {ticker} {" ".join(fields)}.')
+                METRICS.count('subscriptions', result='started')
+            subscription.requested = time.time()
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, name='subscription_sweeper', daemon=True)
+                self._sweeper.start()
+
+        subscription.started.wait(SubscriptionManager.START_TIMEOUT_SECS)
+        if subscription.failure is not None:
+            self._drop(key, subscription)
+            METRICS.count('subscriptions', result='failed')
+            raise SubscriptionError(f"Subscription to {ticker} failed: {subscription.failure}.")
+        return subscription.ring.path
+
+    def describe(self, ticker, fields):
+        """Response data of a subscription request: where and how to read its ring."""
+        fields = sorted(set(fields))
+        return {'ring': os.path.abspath(self.subscribe(ticker, fields)), 'fields': fields,
+                'layout': layout(fields, self.capacity)}
+
+    def _on_event(self, event, session):
+        """Runs on the blpapi dispatcher thread."""
+        event_type = event.eventType()
+        for msg in event:
+            message_type = str(msg.messageType())
+            if event_type == blpapi.Event.SESSION_STATUS and message_type in SubscriptionManager.SESSION_DOWN:
+                self._lost(session, message_type)
+                continue
+            for cid in msg.correlationIds():
+                subscription = self._by_cid.get(cid)
+                if subscription is None:
+                    continue
+                if event_type == blpapi.Event.SUBSCRIPTION_DATA:
+                    self._update(subscription, msg)
+                elif message_type == "SubscriptionStarted":
+                    subscription.started.set()
+                elif message_type == "SubscriptionFailure":
+                    element = msg.asElement()
+                    subscription.failure = element.getElement('reason').getElementAsString('description') \
+                        if element.hasElement('reason') else message_type
+                    subscription.started.set()
+                elif message_type == "SubscriptionTerminated":
+                    self._by_cid.pop(cid, None)
+
+    @staticmethod
+    def _update(subscription, msg):
+        element = msg.asElement()
+        for i, field in enumerate(subscription.fields):
+            if element.hasElement(field):
+                try:
+                    subscription.values[i] = element.getElement(field).getValueAsFloat()
+                except (TypeError, ValueError):
+                    pass
+        subscription.ring.append(time.time(), subscription.values)
+
+    def _lost(self, session, reason):
+        """Subscribes everything again on a new session."""
+        LOGGER.warning(f' subscription session down: {reason}.')
+        with self._lock:
+            if self._session is not session:
+                return
+            self._session = None
+            self._by_cid.clear()
+            for subscription in self._subscriptions.values():
+                try:
+                    self._subscribe(subscription)
+                except SubscriptionError as e:
+                    LOGGER.error(f' unable to resubscribe {subscription.ticker}: {e.message}')
+                    break
+
+    def _drop(self, key, subscription):
+        with self._lock:
+            if self._subscriptions.get(key) is not subscription:
+                return
+            del self._subscriptions[key]
+            self._by_cid.pop(subscription.cid, None)
+            if self._session is not None and subscription.failure is None:
+                subscriptions = blpapi.SubscriptionList()
+                subscriptions.add(subscription.ticker, subscription.fields, "", subscription.cid)
+                self._session.unsubscribe(subscriptions)
+        # the map stays open for an update already being dispatched
+        subscription.ring.mark_closed()
+
+    def sweep(self, now=None):
+        """Tears down the subscriptions idle for idle_secs."""
+        now = now or time.time()
+        for key, subscription in list(self._subscriptions.items()):
+            if now - max(subscription.requested, subscription.ring.heartbeat) > self.idle_secs:
+                LOGGER.info(f' unsubscribing idle {subscription.ticker}.')
+                METRICS.count('subscriptions', result='idle')
+                self._drop(key, subscription)
+
+    def _sweep(self):
+        while True:
+            time.sleep(min(SubscriptionManager.SWEEP_SECS, self.idle_secs))
+            try:
+                self.sweep()
+            except Exception as e:
+                LOGGER.error(f' subscription sweep failed: {e!r}')
+
+    def state(self):
+        """Tickers and fields subscribed, for a Snapshot."""
+        return [{'ticker': ticker, 'fields': list(fields)} for ticker, fields in list(self._subscriptions)]
+
+    def restore(self, state):
+        """Subscribes again to the subscriptions of state(), from a background thread."""
+        def resubscribe():
+            for saved in state:
+                try:
+                    self.subscribe(saved['ticker'], saved['fields'])
+                except Exception as e:
+                    LOGGER.error(f' unable to restore subscription to {saved["ticker"]}: {e!r}')
+        if state:
+            threading.Thread(target=resubscribe, name='subscription_restore', daemon=True).start()
+        return len(state)
+
+    def close(self):
+        for key, subscription in list(self._subscriptions.items()):
+            self._drop(key, subscription)
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.stop()
@@ -0,0 +1,186 @@
+"""Single instance lock, request leases and the supervisor of worker processes sharing the spool"""
+import multiprocessing
+import os
+import sys
+import time
+
+from logger import *
+
+if sys.platform.startswith('win'):
+    import msvcrt
+    fcntl = None
+else:
+    import fcntl
+    msvcrt = None
+
+
+class InstanceLock:
+    """
+        Cross-platform single instance lock: an exclusive lock on a file,
+        released by the OS when the process exits, even if it crashed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """True if no other process holds the lock."""
+        lock_file = open(self.path, 'a+')
+        try:
+            lock_file.seek(0)
+            if msvcrt is not None:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LeaseDirectory:
+    """
+        Leases on request files shared by the worker processes: a worker
+        only loads a request file after creating its <name>.lease here,
+        which one process only can do. A lease whose worker died, or older
+        than LEASE_SECS, may be taken over. The rename claim of the request
+        file (Request.claim) stays the final arbiter.
+    """
+    LEASE_SECS = 30
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = str(os.getpid())
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name + '.lease')
+
+    @staticmethod
+    def _alive(pid):
+        if msvcrt is not None:
+            # os.kill(pid, 0) would interrupt the process on Windows, age alone expires leases there
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, OverflowError):
+            return True
+        return True
+
+    def _stale(self, path):
+        try:
+            with open(path, 'r') as inf:
+                owner = inf.read().strip()
+            age = time.time() - os.stat(path).st_mtime
+        except OSError:
+            return True, None
+        if owner == self.pid:
+            return False, owner
+        return age > LeaseDirectory.LEASE_SECS or (owner.isdigit() and not self._alive(int(owner))), owner
+
+    def acquire(self, file_name):
+        """True if this process holds the lease of file_name."""
+        path = self._path(file_name)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                stale, owner = self._stale(path)
+                if owner == self.pid:
+                    return True
+                if not stale:
+                    return False
+                LOGGER.info(f' taking over lease of {file_name} from {owner}.')
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as outf:
+                outf.write(self.pid)
+            return True
+        return False
+
+    def release(self, file_name):
+        try:
+            os.remove(self._path(file_name))
+        except OSError:
+            pass
+
+
+class Supervisor:
+    """
+        Runs `workers` processes of target(worker_id, *args) and restarts
+        any that exits. A worker exiting again within RESTART_SECS of its
+        start waits twice as long before the next restart, up to
+        MAX_BACKOFF_SECS.
+    """
+    CHECK_SECS = 1
+    RESTART_SECS = 10
+    MAX_BACKOFF_SECS = 60
+
+    def __init__(self, workers, target, args=()):
+        self.workers = workers
+        self.target = target
+        self.args = args
+        self._processes = dict()
+        self._started = dict()
+        self._due = dict()
+        self._backoff = {worker_id: 0 for worker_id in range(workers)}
+
+    def _spawn(self, worker_id):
+        process = multiprocessing.Process(target=self.target, args=(worker_id,) + tuple(self.args),
+                                          name=f'bploader_worker_{worker_id}')
+        process.start()
+        self._processes[worker_id] = process
+        self._started[worker_id] = time.time()
+        LOGGER.info(f' worker {worker_id} started with pid {process.pid}.')
+
+    def check(self):
+        """Restarts the workers that exited once their backoff is over."""
+        now = time.time()
+        for worker_id, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            LOGGER.warning(f' worker {worker_id} (pid {process.pid}) exited with {process.exitcode}.')
+            if now - self._started[worker_id] < Supervisor.RESTART_SECS:
+                self._backoff[worker_id] = min(max(1, 2 * self._backoff[worker_id]), Supervisor.MAX_BACKOFF_SECS)
+            else:
+                self._backoff[worker_id] = 0
+            del self._processes[worker_id]
+            self._due[worker_id] = now + self._backoff[worker_id]
+
+        for worker_id, due in list(self._due.items()):
+            if now >= due:
+                del self._due[worker_id]
+                self._spawn(worker_id)
+
+    def run(self):
+        """Starts the workers and keeps them running until interrupted."""
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        try:
+            while True:
+                time.sleep(Supervisor.CHECK_SECS)
+                self.check()
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join()
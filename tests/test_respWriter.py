@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from respReader import read_response
+from respWriter import write_arrow, write_npz
+
+HEADER = {"security": "IBM US Equity", "timestamp": "2021-01-29 10:00:00"}
+SPARSE = {"date": ["2021-01-29", "2021-01-28", "2021-01-27"],
+          "PX_LAST": [122.47, None, 120.08],
+          "BEST_EPS": [None, None, 7.01],
+          "GICS_SECTOR_NAME": ["Information Technology", None, "Information Technology"]}
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_npz_round_trip_of_sparse_fields(tmp_path, mmap):
+    path = str(tmp_path / "response")
+    write_npz(path, HEADER, SPARSE)
+
+    response = read_response(path, mmap=mmap)
+
+    assert response["security"] == HEADER["security"]
+    data = response["data"]
+    assert not any(column.dtype.hasobject for column in data.values())
+    assert data["date"].tolist() == [np.datetime64(d, 'D') for d in SPARSE["date"]]
+    np.testing.assert_array_equal(data["PX_LAST"], [122.47, np.nan, 120.08])
+    np.testing.assert_array_equal(data["BEST_EPS"], [np.nan, np.nan, 7.01])
+    assert data["GICS_SECTOR_NAME"].tolist() == ["Information Technology", "", "Information Technology"]
+
+
+def test_arrow_round_trip_of_sparse_fields(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "response")
+    write_arrow(path, HEADER, SPARSE)
+
+    data = read_response(path)["data"]
+
+    np.testing.assert_array_equal(data["BEST_EPS"], [np.nan, np.nan, 7.01])
+    assert data["GICS_SECTOR_NAME"].tolist() == ["Information Technology", "", "Information Technology"]